@@ -1,9 +1,27 @@
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, Response, render_template_string, request, jsonify, g, has_request_context
 import sqlite3
 import os
+import re
+import io
+import csv
 import json
-import google.generativeai as genai
-from werkzeug.utils import secure_filename
+import zlib
+import base64
+import shutil
+import tempfile
+import time
+import random
+import math
+import secrets
+import hashlib
+import threading
+import queue
+import fcntl
+import weakref
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from urllib.request import pathname2url
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -13,51 +31,1266 @@ app = Flask(__name__)
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv('STREAM_BATCH_SIZE', '500'))  # rows per fetchmany
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+app.config['PAGE_CURSOR_IDLE_TIMEOUT'] = int(os.getenv('PAGE_CURSOR_IDLE_TIMEOUT', '300'))  # seconds
+app.config['MAX_PAGE_CURSORS'] = int(os.getenv('MAX_PAGE_CURSORS', '64'))
+app.config['QUERY_TIMEOUT'] = float(os.getenv('QUERY_TIMEOUT', '30'))  # seconds per query
+app.config['SAMPLE_TIMEOUT'] = float(os.getenv('SAMPLE_TIMEOUT', '2'))  # seconds to read a table's or view's sample rows
+app.config['QUERY_MAX_ROWS'] = int(os.getenv('QUERY_MAX_ROWS', '100000'))  # rows returned per query
+app.config['MAX_CONCURRENT_QUERIES'] = int(os.getenv('MAX_CONCURRENT_QUERIES', '4'))  # per database
+app.config['MAX_QUEUED_QUERIES'] = int(os.getenv('MAX_QUEUED_QUERIES', '16'))  # per database
+app.config['QUERY_QUEUE_TIMEOUT'] = float(os.getenv('QUERY_QUEUE_TIMEOUT', '5'))  # seconds
+app.config['EXPORT_TIMEOUT'] = float(os.getenv('EXPORT_TIMEOUT', '600'))  # seconds per export
+app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))  # rows per fetchmany
+app.config['SQLITE_CACHE_SIZE'] = int(os.getenv('SQLITE_CACHE_SIZE', '-16384'))  # pages, or KiB if negative
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
+app.config['SQLITE_TEMP_STORE'] = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')  # DEFAULT, FILE or MEMORY
+app.config['INDEX_BENCHMARK_MAX_BYTES'] = int(os.getenv('INDEX_BENCHMARK_MAX_BYTES', str(256 * 1024 * 1024)))  # largest table copy built to time index suggestions
+app.config['INDEX_CACHE_MAX_AGE'] = int(os.getenv('INDEX_CACHE_MAX_AGE', '86400'))  # seconds browsers may reuse the page
+app.config['SQLITE_IMMUTABLE'] = os.getenv('SQLITE_IMMUTABLE', '0') == '1'  # uploads are never modified in place
+app.config['LLM_MAX_CONCURRENCY'] = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))  # concurrent Gemini calls
+app.config['LLM_TIMEOUT'] = float(os.getenv('LLM_TIMEOUT', '30'))  # seconds per generation call
+app.config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', '2'))  # batch items only
+app.config['LLM_RETRY_BACKOFF'] = float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))  # seconds, doubled per retry
+app.config['BATCH_MAX_ITEMS'] = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+app.config['BATCH_CONCURRENCY'] = int(os.getenv('BATCH_CONCURRENCY', '4'))  # parallel items per batch
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '1') == '1'  # stage timers, Server-Timing and /metrics
+app.config['TRANSLATION_CACHE_PATH'] = os.getenv('TRANSLATION_CACHE_PATH', 'translation_cache.db')
+app.config['TRANSLATION_CACHE_MAX_ENTRIES'] = int(os.getenv('TRANSLATION_CACHE_MAX_ENTRIES', '5000'))
+app.config['TRANSLATION_CACHE_TTL'] = int(os.getenv('TRANSLATION_CACHE_TTL', str(7 * 24 * 3600)))  # seconds
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))  # bytes per chunk request
+app.config['UPLOAD_MAX_SIZE'] = int(os.getenv('UPLOAD_MAX_SIZE', str(20 * 1024 * 1024 * 1024)))  # bytes per chunked upload
+app.config['UPLOAD_SESSION_TIMEOUT'] = int(os.getenv('UPLOAD_SESSION_TIMEOUT', str(24 * 3600)))  # seconds idle
+app.config['DATABASE_DISK_BUDGET'] = int(os.getenv('DATABASE_DISK_BUDGET', str(50 * 1024 * 1024 * 1024)))  # bytes of stored databases
+app.config['DATABASE_MEMORY_BUDGET'] = int(os.getenv('DATABASE_MEMORY_BUDGET', str(1024 * 1024 * 1024)))  # estimated bytes of warm state
+app.config['DATABASE_IDLE_GRACE'] = int(os.getenv('DATABASE_IDLE_GRACE', '60'))  # seconds before a database may be evicted
+app.config['PROFILER_ENABLED'] = os.getenv('PROFILER_ENABLED', '1') == '1'  # column statistics for prompts
+app.config['PROFILE_SAMPLE_ROWS'] = int(os.getenv('PROFILE_SAMPLE_ROWS', '20000'))  # rows sampled per table
+app.config['PROFILE_TIME_BUDGET'] = float(os.getenv('PROFILE_TIME_BUDGET', '30'))  # seconds per database
+app.config['PROFILE_TOP_K'] = int(os.getenv('PROFILE_TOP_K', '5'))  # frequent values kept per text column
+app.config['PROFILE_TOP_K_MAX_DISTINCT'] = int(os.getenv('PROFILE_TOP_K_MAX_DISTINCT', '50'))  # low-cardinality cutoff
+app.config['SCHEMA_MAX_TABLES'] = int(os.getenv('SCHEMA_MAX_TABLES', '4'))  # matched tables per multi-table prompt
+app.config['SCHEMA_MAX_COLUMNS'] = int(os.getenv('SCHEMA_MAX_COLUMNS', '12'))  # columns per table in a multi-table prompt
+app.config['SIMILARITY_DIRECT_THRESHOLD'] = float(os.getenv('SIMILARITY_DIRECT_THRESHOLD', '0.9'))  # reuse stored SQL as is
+app.config['SIMILARITY_FEW_SHOT_THRESHOLD'] = float(os.getenv('SIMILARITY_FEW_SHOT_THRESHOLD', '0.3'))  # include as an example
+app.config['SIMILARITY_FEW_SHOT_EXAMPLES'] = int(os.getenv('SIMILARITY_FEW_SHOT_EXAMPLES', '3'))
+app.config['SQL_REPAIR_ATTEMPTS'] = int(os.getenv('SQL_REPAIR_ATTEMPTS', '2'))  # re-prompts when generated SQL does not compile
+app.config['SIMILARITY_MAX_EXAMPLES'] = int(os.getenv('SIMILARITY_MAX_EXAMPLES', '2000'))  # stored pairs kept per schema and table
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# Configure Gemini API using environment variable
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set. Please add it to your .env file.")
+# Hot-path instrumentation: per-stage timers feed a Server-Timing header and
+# Prometheus histograms. With METRICS_ENABLED off, timed_stage() hands back a
+# shared no-op context manager and the request hooks return immediately.
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+metric_histograms = {}
+metric_counters = {}
+metrics_lock = threading.Lock()
+NO_STAGE = nullcontext()
 
-genai.configure(api_key=GEMINI_API_KEY)
+def observe_metric(name, value, **labels):
+    """Record a value in a histogram with the default buckets"""
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        histogram = metric_histograms.get(key)
+        if histogram is None:
+            histogram = metric_histograms[key] = {'buckets': [0] * len(METRIC_BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(METRIC_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
 
-# Initialize the model
-model = genai.GenerativeModel('gemini-1.5-flash')
+def inc_metric(name, amount=1, **labels):
+    if not app.config['METRICS_ENABLED']:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        metric_counters[key] = metric_counters.get(key, 0) + amount
+
+class StageTimer:
+    """Time one stage of request handling"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        observe_metric('nl2sql_stage_duration_seconds', elapsed, stage=self.name)
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((self.name, elapsed))
+        return False
+
+def timed_stage(name):
+    if not app.config['METRICS_ENABLED']:
+        return NO_STAGE
+    return StageTimer(name)
+
+@app.before_request
+def start_request_timer():
+    if app.config['METRICS_ENABLED']:
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    if not app.config['METRICS_ENABLED'] or 'request_start' not in g:
+        return response
+
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_metric('nl2sql_request_duration_seconds', elapsed, route=route, method=request.method)
+    inc_metric('nl2sql_requests_total', route=route, method=request.method, status=str(response.status_code))
+    if not response.is_streamed and response.content_length is not None:
+        inc_metric('nl2sql_response_bytes_total', response.content_length, route=route)
+
+    # Streamed responses report time to first byte rather than the full body
+    timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.get('stage_timings', [])]
+    timings.append(f"total;dur={elapsed * 1000:.2f}")
+    response.headers['Server-Timing'] = ", ".join(timings)
+    return response
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = [f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels]
+    return '{' + ','.join(escaped) + '}'
+
+def render_metrics():
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    with metrics_lock:
+        histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in metric_histograms.items()}
+        counters = dict(metric_counters)
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{format_metric_labels(labels)} {value}")
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        for bound, count in zip(METRIC_BUCKETS, histogram['buckets']):
+            lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', f'{bound:g}'),))} {count}")
+        lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{name}_sum{format_metric_labels(labels)} {histogram['sum']:.6f}")
+        lines.append(f"{name}_count{format_metric_labels(labels)} {histogram['count']}")
+
+    # Values read from the caches, pools and schedulers at scrape time
+    snapshot = []
+    with schema_cache_lock:
+        hits, misses = schema_cache_stats['hits'], schema_cache_stats['misses']
+    snapshot.append(('nl2sql_schema_cache_hits_total', 'counter', hits, ()))
+    snapshot.append(('nl2sql_schema_cache_misses_total', 'counter', misses, ()))
+    snapshot.append(('nl2sql_schema_cache_hit_ratio', 'gauge', hits / (hits + misses) if hits + misses else 0, ()))
+    with translation_cache_lock:
+        hits, misses = translation_cache_stats['hits'], translation_cache_stats['misses']
+    snapshot.append(('nl2sql_translation_cache_hits_total', 'counter', hits, ()))
+    snapshot.append(('nl2sql_translation_cache_misses_total', 'counter', misses, ()))
+    snapshot.append(('nl2sql_translation_cache_hit_ratio', 'gauge', hits / (hits + misses) if hits + misses else 0, ()))
+    with llm_lock:
+        snapshot.append(('nl2sql_llm_in_flight', 'gauge', len(llm_in_flight), ()))
+        snapshot.append(('nl2sql_llm_calls_total', 'counter', llm_stats['calls'], ()))
+        snapshot.append(('nl2sql_llm_coalesced_total', 'counter', llm_stats['coalesced'], ()))
+    with connection_pool_lock:
+        snapshot.append(('nl2sql_sqlite_connections', 'gauge', connection_pool_stats['open'], (('kind', 'pooled'),)))
+    with page_cursors_lock:
+        snapshot.append(('nl2sql_sqlite_connections', 'gauge', len(page_cursors), (('kind', 'page_cursor'),)))
+    with running_queries_lock:
+        snapshot.append(('nl2sql_running_queries', 'gauge', len(running_queries), ()))
+
+    for name, metric_type, value, labels in snapshot:
+        if name not in seen:
+            lines.append(f"# TYPE {name} {metric_type}")
+            seen.add(name)
+        lines.append(f"{name}{format_metric_labels(labels)} {value:g}")
+
+    return "\n".join(lines) + "\n"
+
+# Generation backends. LLM_BACKEND selects Gemini (the default) or a local
+# deterministic stand-in used for benchmarks and offline load tests.
+MODEL_NAME = 'gemini-1.5-flash'
+
+class GeminiBackend:
+    """Generate text with the Gemini API"""
+
+    def __init__(self, model_name, api_key):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        response = self.model.generate_content(prompt)
+        return response.text
+
+    def generate_stream(self, prompt):
+        """Yield text chunks as the model produces them"""
+        for chunk in self.model.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # chunks without text parts, e.g. a final safety rating
+            if text:
+                yield text
+
+class FakeBackend:
+    """Deterministic local stand-in for Gemini with configurable latency and failure injection"""
+
+    model_name = 'fake-llm'
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self.lock:
+            delay = self.latency + self.jitter * self.random.random()
+            fail = self.random.random() < self.failure_rate
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("Injected fake backend failure")
+
+        return self.answer(prompt)
+
+    def generate_stream(self, prompt, chunk_size=8):
+        """Yield the same answer in small chunks, spreading the latency across them"""
+        with self.lock:
+            delay = self.latency + self.jitter * self.random.random()
+            fail = self.random.random() < self.failure_rate
+        text = self.answer(prompt)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        for i, chunk in enumerate(chunks):
+            time.sleep(delay / len(chunks))
+            if fail and i == len(chunks) // 2:
+                raise RuntimeError("Injected fake backend failure")
+            yield chunk
+
+    def answer(self, prompt):
+        # Answer with a plain query on the first table named in the prompt
+        match = re.search(r'^Table: (.+)$', prompt, re.MULTILINE)
+        table_name = match.group(1).strip() if match else 'sqlite_master'
+        return f"```sql\nSELECT * FROM {quote_identifier(table_name)} LIMIT 100;\n```"
+
+def check_llm_backend():
+    """Validate the backend settings without importing or constructing the client"""
+    backend = os.getenv('LLM_BACKEND', 'gemini').lower()
+    if backend not in ('gemini', 'fake'):
+        raise ValueError(f"Unknown LLM_BACKEND '{backend}'. Use 'gemini' or 'fake'.")
+    if backend == 'gemini' and not os.getenv("GEMINI_API_KEY"):
+        raise ValueError("GEMINI_API_KEY environment variable is not set. Please add it to your .env file.")
+    return backend
+
+def create_llm_backend():
+    backend = check_llm_backend()
+    if backend == 'fake':
+        return FakeBackend(
+            latency=float(os.getenv('FAKE_LLM_LATENCY', '0')),
+            jitter=float(os.getenv('FAKE_LLM_JITTER', '0')),
+            failure_rate=float(os.getenv('FAKE_LLM_FAILURE_RATE', '0')),
+            seed=int(os.getenv('FAKE_LLM_SEED', '0'))
+        )
+
+    # Configure Gemini API using environment variable
+    return GeminiBackend(MODEL_NAME, os.getenv("GEMINI_API_KEY"))
+
+# Importing google.generativeai and building the model takes most of a cold
+# start, so workers only check the settings at import time and construct the
+# client on first use, or in a background thread when LLM_WARMUP is on.
+LLM_BACKEND_NAME = check_llm_backend()
+LLM_MODEL_NAME = FakeBackend.model_name if LLM_BACKEND_NAME == 'fake' else MODEL_NAME
+llm_backend = None
+llm_backend_lock = threading.Lock()
+llm_startup = {'warmup': False, 'ready_ms': None}
+
+def get_llm_backend():
+    global llm_backend
+    if llm_backend is None:
+        with llm_backend_lock:
+            if llm_backend is None:
+                started = time.perf_counter()
+                llm_backend = create_llm_backend()
+                llm_startup['ready_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return llm_backend
+
+def warm_llm_backend():
+    try:
+        get_llm_backend()
+    except Exception as e:
+        # The first request retries and reports the error
+        app.logger.warning("LLM warm-up failed: %s", e)
+
+if os.getenv('LLM_WARMUP', '1') == '1':
+    llm_startup['warmup'] = True
+    threading.Thread(target=warm_llm_backend, name='llm-warmup', daemon=True).start()
+
+# In-process schema cache, keyed by database path and validated by fingerprint
+schema_cache = {}
+schema_cache_sizes = {}  # abs path -> serialized size of the cached entry, for the memory budget
+schema_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+schema_cache_lock = threading.Lock()
+
+# Long-lived connections used only for fingerprinting, so that
+# PRAGMA data_version reports commits made by other connections
+fingerprint_connections = {}
+
+def get_database_fingerprint(db_path):
+    """Identify a database by path, inode, size, mtime and SQLite change counters"""
+    abs_path = os.path.abspath(db_path)
+    stat = os.stat(abs_path)
+
+    with schema_cache_lock:
+        entry = fingerprint_connections.get(abs_path)
+        if entry is None or entry[0] != stat.st_ino:
+            if entry is not None:
+                entry[1].close()
+            conn = connect_readonly(abs_path, immutable=False, check_same_thread=False)
+            entry = (stat.st_ino, conn)
+            fingerprint_connections[abs_path] = entry
+
+        cursor = entry[1].cursor()
+        cursor.execute("PRAGMA schema_version;")
+        schema_version = cursor.fetchone()[0]
+        cursor.execute("PRAGMA data_version;")
+        data_version = cursor.fetchone()[0]
+
+    return (abs_path, stat.st_ino, stat.st_size, stat.st_mtime_ns, schema_version, data_version)
+
+def invalidate_schema_cache(db_path):
+    """Drop cached schema and fingerprint connection for a database that was replaced"""
+    abs_path = os.path.abspath(db_path)
+    with schema_cache_lock:
+        if schema_cache.pop(abs_path, None) is not None:
+            schema_cache_stats['invalidations'] += 1
+        schema_cache_sizes.pop(abs_path, None)
+        entry = fingerprint_connections.pop(abs_path, None)
+        if entry is not None:
+            entry[1].close()
+
+# Per-thread pool of read-only connections, one per database, recycled when
+# the database fingerprint changes so warm page caches and mmaps are reused.
+# A thread's connections are closed and uncounted when the thread exits.
+connection_pool_local = threading.local()
+connection_pool_stats = {'opened': 0, 'reused': 0, 'recycled': 0, 'evicted': 0, 'released': 0, 'open': 0}
+connection_pool_lock = threading.Lock()
+connection_counts = {}  # abs path -> pooled connections open across all threads, excluding evicted ones
+database_generations = {}  # abs path -> times evicted from memory; older pooled connections are closed
+
+def connect_readonly(db_path, immutable=None, check_same_thread=True):
+    """Open a read-only connection via URI with the configured page cache, mmap and temp store"""
+    if immutable is None:
+        immutable = app.config['SQLITE_IMMUTABLE']
+    uri = f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+
+    temp_store = app.config['SQLITE_TEMP_STORE'].upper()
+    if temp_store not in ('DEFAULT', 'FILE', 'MEMORY'):
+        raise ValueError(f"Invalid SQLITE_TEMP_STORE: {temp_store}")
+
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA cache_size = {int(app.config['SQLITE_CACHE_SIZE'])};")
+    conn.execute(f"PRAGMA mmap_size = {int(app.config['SQLITE_MMAP_SIZE'])};")
+    conn.execute(f"PRAGMA temp_store = {temp_store};")
+    return conn
+
+class PoolOwner:
+    """Kept only in a thread's local storage, so it is collected when the thread exits"""
+
+def close_pooled_connection(pool, abs_path, stat):
+    fingerprint, conn, generation = pool.pop(abs_path)
+    try:
+        conn.close()
+    except sqlite3.ProgrammingError:
+        pass  # closed from another thread; SQLite frees it when the object is collected
+    with connection_pool_lock:
+        connection_pool_stats[stat] += 1
+        connection_pool_stats['open'] -= 1
+        # Connections from before an eviction were already dropped from the count
+        if generation == database_generations.get(abs_path, 0):
+            connection_counts[abs_path] -= 1
+
+def release_thread_connections(pool):
+    """Close the pooled connections of a thread that has exited"""
+    for abs_path in list(pool):
+        close_pooled_connection(pool, abs_path, 'released')
+
+def get_pooled_connection(db_path):
+    """Return this thread's read-only connection to a database, reopening it if the file changed"""
+    fingerprint = get_database_fingerprint(db_path)
+    pool = getattr(connection_pool_local, 'connections', None)
+    if pool is None:
+        pool = connection_pool_local.connections = {}
+        connection_pool_local.owner = PoolOwner()
+        weakref.finalize(connection_pool_local.owner, release_thread_connections, pool)
+
+    # Release this thread's connections to databases evicted since they were opened
+    for abs_path in [path for path, entry in pool.items() if entry[2] != database_generations.get(path, 0)]:
+        close_pooled_connection(pool, abs_path, 'evicted')
+
+    entry = pool.get(fingerprint[0])
+    if entry is not None:
+        if entry[0] == fingerprint:
+            with connection_pool_lock:
+                connection_pool_stats['reused'] += 1
+            return entry[1]
+        close_pooled_connection(pool, fingerprint[0], 'recycled')
+
+    conn = connect_readonly(db_path)
+    pool[fingerprint[0]] = (fingerprint, conn, database_generations.get(fingerprint[0], 0))
+    with connection_pool_lock:
+        connection_pool_stats['opened'] += 1
+        connection_pool_stats['open'] += 1
+        connection_counts[fingerprint[0]] = connection_counts.get(fingerprint[0], 0) + 1
+    enforce_memory_budget()
+    return conn
+
+def quote_identifier(name):
+    """Quote an SQLite identifier so names with spaces or quotes are safe to interpolate"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+# SQL guard. Statements are compiled with EXPLAIN, which prepares them without
+# running them, under an authorizer that denies every action except reads, so
+# writes, schema changes, ATTACH and PRAGMA fail with SQLITE_AUTH before any
+# row is touched. Compiling also catches syntax errors and unknown columns.
+# VACUUM (including VACUUM INTO) and REINDEX never consult the authorizer, so a
+# statement is only accepted if it reported at least one SQLITE_SELECT.
+READ_ONLY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+def compile_read_only(conn, query):
+    """Compile a statement without running it, raising sqlite3.Error unless it only reads"""
+    actions = {'select': False, 'denied': False}
+
+    def authorize_read_only(action, arg1, arg2, db_name, trigger):
+        if action not in READ_ONLY_ACTIONS:
+            actions['denied'] = True
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_SELECT:
+            actions['select'] = True
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorize_read_only)
+    try:
+        conn.execute(f"EXPLAIN {query}")
+    finally:
+        conn.set_authorizer(None)
+    if actions['denied'] or not actions['select']:
+        raise sqlite3.DatabaseError('not authorized')
+
+def is_authorization_error(e):
+    # Denied reads inside table-valued functions surface as SQLITE_ERROR with the same message
+    return getattr(e, 'sqlite_errorname', '') == 'SQLITE_AUTH' or str(e) == 'not authorized'
+
+def read_only_query_error(db_path, query):
+    """Return an error message for a query that is not a single read-only statement, or None"""
+    try:
+        compile_read_only(get_pooled_connection(db_path), query)
+    except sqlite3.Error as e:
+        if is_authorization_error(e):
+            return 'Only SELECT queries are allowed for security reasons.'
+        return f'SQL Error: {str(e)}'
+    return None
 
 def get_database_info(db_path):
-    """Extract database schema and sample data"""
+    """Return database schema and sample data, served from cache when unchanged"""
     if not os.path.exists(db_path):
         return "No database found."
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        table_names = [table[0] for table in tables]
-        database_info = {}
+        fingerprint = get_database_fingerprint(db_path)
+    except (OSError, sqlite3.Error) as e:
+        return {"error": f"Error retrieving schema: {str(e)}"}
 
-        for table_name in table_names:
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns = cursor.fetchall()
-            column_info = [{"name": col[1], "type": col[2]} for col in columns]
+    with schema_cache_lock:
+        cached = schema_cache.get(fingerprint[0])
+        if cached is not None and cached[0] == fingerprint:
+            schema_cache_stats['hits'] += 1
+            return cached[1]
+        schema_cache_stats['misses'] += 1
 
-            cursor.execute(f"SELECT * FROM {table_name} LIMIT 3;")
-            rows = cursor.fetchall()
-            sample_data = [dict(zip([col["name"] for col in column_info], row)) for row in rows]
+    database_info = introspect_database(db_path)
+    if isinstance(database_info, dict) and 'error' not in database_info:
+        size = len(json.dumps(database_info, default=str))
+        with schema_cache_lock:
+            schema_cache[fingerprint[0]] = (fingerprint, database_info)
+            schema_cache_sizes[fingerprint[0]] = size
+        enforce_memory_budget()
+        schedule_column_profile(db_path)
+    return database_info
 
-            database_info[table_name] = {"columns": column_info, "sample_data": sample_data}
+def introspect_database(db_path):
+    """Extract the columns of every table and view with one query over sqlite_schema"""
+    try:
+        conn = get_pooled_connection(db_path)
+        try:
+            rows = conn.execute("""
+                SELECT s.name, s.type, p.name, p.type
+                FROM sqlite_schema AS s JOIN pragma_table_info(s.name) AS p
+                WHERE s.type IN ('table', 'view')
+                ORDER BY s.rowid, p.cid;
+            """).fetchall()
+        except sqlite3.OperationalError:
+            # A view over a missing table fails the whole join; fall back to one object at a time
+            rows = []
+            for name, object_type in conn.execute("SELECT name, type FROM sqlite_schema WHERE type IN ('table', 'view') ORDER BY rowid;").fetchall():
+                try:
+                    columns = conn.execute("SELECT name, type FROM pragma_table_info(?) ORDER BY cid;", (name,)).fetchall()
+                except sqlite3.OperationalError:
+                    continue
+                rows.extend((name, object_type, column, column_type) for column, column_type in columns)
 
-        conn.close()
-        return {"tables": table_names, "data": database_info}
+        database_info = {}
+        for name, object_type, column, column_type in rows:
+            entry = database_info.get(name)
+            if entry is None:
+                entry = database_info[name] = {"type": object_type, "columns": []}
+            entry["columns"].append({"name": column, "type": column_type})
+
+        # Stable digest of the schema, shared across processes and restarts
+        schema_json = json.dumps(database_info, sort_keys=True, default=str)
+        fingerprint = hashlib.sha256(schema_json.encode('utf-8')).hexdigest()[:16]
+
+        return {"tables": list(database_info), "data": database_info, "fingerprint": fingerprint, "samples": {}, "sample_notes": {}}
 
     except sqlite3.Error as e:
         return {"error": f"Error retrieving schema: {str(e)}"}
 
+def get_table_details(db_path, database_info, table_name, sample_rows=3):
+    """Columns plus a few sample rows for one table, sampled on first use and kept with the cached schema"""
+    table_data = database_info['data'].get(table_name)
+    if table_data is None:
+        return None
+
+    sample_data = database_info['samples'].get(table_name)
+    if sample_data is None:
+        # A view can take arbitrarily long to produce its first rows, so sampling gets a short budget
+        conn = get_pooled_connection(db_path)
+        query_id = f"sample-{secrets.token_hex(8)}"
+        guard = start_query_guard(conn, query_id, min(app.config['SAMPLE_TIMEOUT'], app.config['QUERY_TIMEOUT']))
+        try:
+            cursor = conn.execute(f"SELECT * FROM {quote_identifier(table_name)} LIMIT {int(sample_rows)};")
+            names = [description[0] for description in cursor.description]
+            sample_data = [dict(zip(names, row)) for row in cursor.fetchall()]
+        except sqlite3.OperationalError:
+            if not guard['timed_out']:
+                raise
+            sample_data = []
+            database_info['sample_notes'][table_name] = f"No sample rows: reading them took longer than {guard['timeout']:g} seconds."
+        finally:
+            finish_query_guard(query_id, guard)
+        database_info['samples'][table_name] = sample_data
+
+    details = {"name": table_name, "type": table_data['type'], "columns": table_data['columns'], "sample_data": sample_data}
+    if table_name in database_info['sample_notes']:
+        details['sample_note'] = database_info['sample_notes'][table_name]
+    return details
+
+# Column statistics profiler. After an upload (or the first introspection of
+# a database) a background job samples every table in bounded time and stores
+# per-column null fraction, approximate distinct count, min/max and the most
+# frequent values of low-cardinality text columns, keyed by database path and
+# schema fingerprint. The prompt builder reads them without touching the data.
+PROFILE_SAMPLE_BLOCKS = 20
+PROFILE_VALUE_MAX_LENGTH = 40
+column_profiles = {}
+profiles_pending = set()
+profiler_stats = {'scheduled': 0, 'completed': 0, 'failed': 0, 'tables': 0, 'seconds': 0.0}
+profiler_lock = threading.Lock()
+profiler_executor = None
+
+def get_profiler_executor():
+    global profiler_executor
+    with profiler_lock:
+        if profiler_executor is None:
+            profiler_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profiler')
+        return profiler_executor
+
+def schedule_column_profile(db_path):
+    """Queue a profile of a database unless one is stored or already queued"""
+    if not app.config['PROFILER_ENABLED']:
+        return
+    abs_path = os.path.abspath(db_path)
+    with profiler_lock:
+        if abs_path in profiles_pending or any(key[0] == abs_path for key in column_profiles):
+            return
+        profiles_pending.add(abs_path)
+        profiler_stats['scheduled'] += 1
+    get_profiler_executor().submit(run_column_profile, abs_path)
+
+def get_column_profile(db_path, fingerprint):
+    """Stored column statistics for a database, or None while it is still being profiled"""
+    with profiler_lock:
+        return column_profiles.get((os.path.abspath(db_path), fingerprint))
+
+def drop_column_profiles(db_path):
+    abs_path = os.path.abspath(db_path)
+    with profiler_lock:
+        for key in [key for key in column_profiles if key[0] == abs_path]:
+            del column_profiles[key]
+
+def sample_table_rows(conn, table_name, columns, sample_rows):
+    """Read at most sample_rows rows, as random rowid blocks when the table is larger; returns (rows, complete)"""
+    column_list = ', '.join(quote_identifier(c) for c in columns)
+    select = f"SELECT {column_list} FROM {quote_identifier(table_name)}"
+    try:
+        low, high = conn.execute(f"SELECT min(rowid), max(rowid) FROM {quote_identifier(table_name)};").fetchone()
+    except sqlite3.Error:
+        low = high = None  # WITHOUT ROWID tables: fall back to the first rows
+
+    if low is None or high - low + 1 <= sample_rows:
+        rows = conn.execute(f"{select} LIMIT {sample_rows + 1};").fetchall()
+        return rows[:sample_rows], len(rows) <= sample_rows
+
+    # Each block is an index seek on rowid, so the cost does not grow with the table
+    block = max(1, sample_rows // PROFILE_SAMPLE_BLOCKS)
+    rng = random.Random(table_name)
+    rows = []
+    next_rowid = low
+    for start in sorted(rng.randint(low, high) for _ in range(PROFILE_SAMPLE_BLOCKS)):
+        # Blocks never overlap, so no row is counted twice
+        block_rows = conn.execute(
+            f"SELECT rowid, {column_list} FROM {quote_identifier(table_name)} WHERE rowid >= ? ORDER BY rowid LIMIT {block};",
+            (max(start, next_rowid),)
+        ).fetchall()
+        if block_rows:
+            next_rowid = block_rows[-1][0] + 1
+            rows.extend(row[1:] for row in block_rows)
+    return rows, False
+
+def profile_column(values, complete, table_rows):
+    """Statistics for one column from its sampled values"""
+    sampled = len(values)
+    present = [v for v in values if v is not None]
+    counts = Counter(v if not isinstance(v, bytes) else None for v in present)
+    counts.pop(None, None)
+    stats = {'null_fraction': round(1 - len(present) / sampled, 4) if sampled else 0.0}
+
+    # Good-Turing style scale-up: values seen once in the sample stand in for unseen ones
+    distinct = len(counts)
+    if not complete and sampled:
+        singletons = sum(1 for count in counts.values() if count == 1)
+        if singletons == len(present):
+            distinct = round(table_rows * len(present) / sampled)  # looks unique, e.g. a key
+        else:
+            distinct = round((table_rows / sampled) ** 0.5 * singletons + distinct - singletons)
+    stats['distinct'] = distinct
+    stats['distinct_exact'] = complete
+
+    comparable = [v for v in counts if isinstance(v, (int, float))] or [v for v in counts if isinstance(v, str)]
+    if comparable:
+        stats['min'] = min(comparable)
+        stats['max'] = max(comparable)
+        if isinstance(stats['min'], str):
+            stats['min'] = stats['min'][:PROFILE_VALUE_MAX_LENGTH]
+            stats['max'] = stats['max'][:PROFILE_VALUE_MAX_LENGTH]
+        # A sample rarely contains the true extremes
+        stats['range_exact'] = complete
+
+    text_values = [v for v in counts if isinstance(v, str)]
+    if text_values and distinct <= app.config['PROFILE_TOP_K_MAX_DISTINCT']:
+        stats['top_values'] = [[v[:PROFILE_VALUE_MAX_LENGTH], counts[v]]
+                               for v, _ in Counter({v: counts[v] for v in text_values}).most_common(app.config['PROFILE_TOP_K'])]
+    return stats
+
+def run_column_profile(abs_path):
+    """Background job: profile every table of a database within the time budget"""
+    started = time.monotonic()
+    deadline = started + app.config['PROFILE_TIME_BUDGET']
+    try:
+        database_info = get_database_info(abs_path)
+        if not isinstance(database_info, dict) or 'error' in database_info:
+            raise ValueError(database_info.get('error') if isinstance(database_info, dict) else database_info)
+
+        conn = connect_readonly(abs_path)
+        try:
+            # Stop any single statement that would overrun the budget
+            conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+            profile = {}
+            for table_name, table_data in database_info['data'].items():
+                if table_data['type'] != 'table' or table_name.startswith('sqlite_'):
+                    continue
+                if time.monotonic() > deadline:
+                    break
+                columns = [col['name'] for col in table_data['columns']]
+                try:
+                    rows, complete = sample_table_rows(conn, table_name, columns, app.config['PROFILE_SAMPLE_ROWS'])
+                except sqlite3.Error:
+                    continue
+                table_rows = len(rows)
+                if not complete:
+                    try:
+                        table_rows = conn.execute(f"SELECT max(rowid) - min(rowid) + 1 FROM {quote_identifier(table_name)};").fetchone()[0]
+                    except sqlite3.Error:
+                        pass
+                profile[table_name] = {
+                    'sampled_rows': len(rows),
+                    'columns': {column: profile_column([row[i] for row in rows], complete, table_rows)
+                                for i, column in enumerate(columns)}
+                }
+        finally:
+            conn.close()
+
+        with profiler_lock:
+            column_profiles[(abs_path, database_info['fingerprint'])] = profile
+            profiler_stats['completed'] += 1
+            profiler_stats['tables'] += len(profile)
+            profiler_stats['seconds'] += time.monotonic() - started
+    except Exception:
+        with profiler_lock:
+            profiler_stats['failed'] += 1
+    finally:
+        with profiler_lock:
+            profiles_pending.discard(abs_path)
+
+def format_column_stats(table_profile):
+    """Render a table's column statistics as prompt lines"""
+    lines = []
+    for column, stats in table_profile['columns'].items():
+        parts = []
+        if stats['null_fraction']:
+            parts.append(f"{stats['null_fraction']:.0%} null")
+        parts.append(f"{'' if stats['distinct_exact'] else '~'}{stats['distinct']} distinct")
+        if 'top_values' in stats:
+            parts.append("values: " + ", ".join(f"{value!r} ({count})" for value, count in stats['top_values']))
+        elif 'min' in stats:
+            approximate = '' if stats['range_exact'] else '~'
+            parts.append(f"range {approximate}{stats['min']!r} to {approximate}{stats['max']!r}")
+        lines.append(f"- {column}: {', '.join(parts)}")
+    return "\n".join(lines)
+
+# Multi-table mode. A lexical BM25 index over table names, column names and
+# profiled column values is built once per schema fingerprint, together with
+# the foreign-key graph. Each question keeps only the best matching tables,
+# the tables on join paths between them and their relevant columns, so the
+# prompt stays about the same size however wide the schema is.
+MULTI_TABLE = '*'
+SCHEMA_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'by', 'for', 'from', 'get', 'give', 'how', 'i', 'in', 'is', 'it',
+    'list', 'me', 'of', 'on', 'or', 'show', 'that', 'the', 'their', 'them', 'to', 'what', 'which', 'who', 'with'
+}
+SCHEMA_FIELD_WEIGHTS = {'table': 3, 'column': 2, 'value': 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_JOIN_PATH = 3
+schema_indexes = {}
+schema_index_lock = threading.Lock()
+
+def tokenize_schema_text(text):
+    """Lowercase word tokens with snake_case and camelCase split and plurals folded"""
+    words = re.findall(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+', str(text))
+    tokens = []
+    for word in words:
+        word = word.lower()
+        if word in SCHEMA_STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+def build_schema_index(db_path, database_info, profile):
+    """Index tables for lexical lookup and collect primary and foreign keys"""
+    conn = get_pooled_connection(db_path)
+    primary_keys = {}
+    for table_name, column in conn.execute("""
+        SELECT s.name, p.name FROM sqlite_schema AS s JOIN pragma_table_info(s.name) AS p
+        WHERE s.type = 'table' AND p.pk > 0 ORDER BY s.name, p.pk;
+    """).fetchall():
+        primary_keys.setdefault(table_name, []).append(column)
+
+    tables = {}
+    for table_name, table_data in database_info['data'].items():
+        if table_name.startswith('sqlite_'):
+            continue
+        terms = Counter()
+        column_terms = {}
+        for token in tokenize_schema_text(table_name):
+            terms[token] += SCHEMA_FIELD_WEIGHTS['table']
+        table_profile = (profile or {}).get(table_name, {}).get('columns', {})
+        for col in table_data['columns']:
+            tokens = set(tokenize_schema_text(col['name']))
+            for token in tokens:
+                terms[token] += SCHEMA_FIELD_WEIGHTS['column']
+            for value, _ in table_profile.get(col['name'], {}).get('top_values', []):
+                value_tokens = tokenize_schema_text(value)
+                tokens.update(value_tokens)
+                for token in value_tokens:
+                    terms[token] += SCHEMA_FIELD_WEIGHTS['value']
+            column_terms[col['name']] = tokens
+        tables[table_name] = {
+            'terms': terms,
+            'length': sum(terms.values()),
+            'columns': table_data['columns'],
+            'column_terms': column_terms,
+            'primary_key': primary_keys.get(table_name, [])
+        }
+
+    # Declared foreign keys; a missing target column means the parent's primary key
+    edges = {name: [] for name in tables}
+    for table_name, parent, column, parent_column in conn.execute("""
+        SELECT s.name, f."table", f."from", f."to" FROM sqlite_schema AS s JOIN pragma_foreign_key_list(s.name) AS f
+        WHERE s.type = 'table';
+    """).fetchall():
+        if table_name in tables and parent in tables:
+            parent_column = parent_column or (tables[parent]['primary_key'] or ['rowid'])[0]
+            edges[table_name].append((column, parent, parent_column))
+            edges[parent].append((parent_column, table_name, column))
+
+    document_frequency = Counter(term for table in tables.values() for term in table['terms'])
+    return {
+        'tables': tables,
+        'edges': edges,
+        'document_frequency': document_frequency,
+        'average_length': (sum(table['length'] for table in tables.values()) / len(tables)) if tables else 1.0
+    }
+
+def get_schema_index(db_path, database_info):
+    """Schema index for a database, rebuilt when the schema changes or column statistics arrive"""
+    profile = get_column_profile(db_path, database_info['fingerprint'])
+    key = (os.path.abspath(db_path), database_info['fingerprint'], profile is not None)
+    with schema_index_lock:
+        index = schema_indexes.get(key)
+    if index is None:
+        index = build_schema_index(db_path, database_info, profile)
+        with schema_index_lock:
+            for stale in [k for k in schema_indexes if k[0] == key[0]]:
+                del schema_indexes[stale]
+            schema_indexes[key] = index
+    return index
+
+def find_join_path(index, start_tables, target):
+    """Shortest foreign-key path from any of start_tables to target, as a list of tables"""
+    previous = {table: None for table in start_tables}
+    frontier = list(start_tables)
+    for _ in range(MAX_JOIN_PATH):
+        next_frontier = []
+        for table in frontier:
+            for _, other, _ in index['edges'].get(table, []):
+                if other in previous:
+                    continue
+                previous[other] = table
+                if other == target:
+                    path = [other]
+                    while previous[path[-1]] is not None:
+                        path.append(previous[path[-1]])
+                    return path[::-1]
+                next_frontier.append(other)
+        frontier = next_frontier
+    return None
+
+def select_relevant_schema(index, nl_query):
+    """Pick the tables, columns and join relationships a question needs"""
+    query_terms = set(tokenize_schema_text(nl_query))
+    table_count = len(index['tables'])
+    scores = {}
+    for table_name, table in index['tables'].items():
+        score = 0.0
+        for term in query_terms:
+            frequency = table['terms'].get(term)
+            if not frequency:
+                continue
+            document_frequency = index['document_frequency'][term]
+            idf = math.log(1 + (table_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * table['length'] / index['average_length'])
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        if score > 0:
+            scores[table_name] = score
+
+    ranked = sorted(scores, key=lambda name: -scores[name])
+    if not ranked:
+        return None
+    selected = [name for name in ranked[:app.config['SCHEMA_MAX_TABLES']] if scores[name] >= scores[ranked[0]] * 0.3]
+
+    # Add the tables that connect the matches to each other
+    tables = [selected[0]]
+    for table_name in selected[1:]:
+        if table_name in tables:
+            continue
+        path = find_join_path(index, tables, table_name)
+        tables.extend(t for t in (path or [table_name]) if t not in tables)
+
+    relationships = []
+    for table_name in tables:
+        for column, other, other_column in index['edges'][table_name]:
+            relation = (table_name, column, other, other_column)
+            reverse = (other, other_column, table_name, column)
+            if other in tables and reverse not in relationships and relation not in relationships:
+                relationships.append(relation)
+
+    columns = {}
+    for table_name in tables:
+        table = index['tables'][table_name]
+        keys = set(table['primary_key'])
+        keys.update(column for t, column, _, _ in relationships if t == table_name)
+        keys.update(column for _, _, t, column in relationships if t == table_name)
+        matched = {name for name, terms in table['column_terms'].items() if terms & query_terms}
+        chosen = [col for col in table['columns'] if col['name'] in keys or col['name'] in matched]
+        for col in table['columns']:
+            if len(chosen) >= app.config['SCHEMA_MAX_COLUMNS']:
+                break
+            if col not in chosen:
+                chosen.append(col)
+        order = {col['name']: i for i, col in enumerate(table['columns'])}
+        columns[table_name] = sorted(chosen[:max(app.config['SCHEMA_MAX_COLUMNS'], len(keys | matched))], key=lambda col: order[col['name']])
+
+    return {
+        'tables': tables,
+        'columns': columns,
+        'relationships': relationships,
+        'scores': {name: round(scores.get(name, 0.0), 3) for name in tables}
+    }
+
+# Persistent NL-to-SQL translation cache, stored in a sidecar SQLite file so
+# that it survives restarts and is shared by all worker processes
+translation_cache_local = threading.local()
+translation_cache_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'errors': 0}
+translation_cache_lock = threading.Lock()
+
+def get_translation_cache_connection():
+    """Return this thread's connection to the translation cache database"""
+    cache_path = app.config['TRANSLATION_CACHE_PATH']
+    conn = getattr(translation_cache_local, 'conn', None)
+    if conn is None or translation_cache_local.path != cache_path:
+        conn = sqlite3.connect(cache_path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                cache_key TEXT PRIMARY KEY,
+                sql_query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used);")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS examples (
+                schema_fingerprint TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                question TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (schema_fingerprint, table_name, question)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS examples_created_at ON examples (created_at);")
+        translation_cache_local.conn = conn
+        translation_cache_local.path = cache_path
+    return conn
+
+def count_translation_cache(name):
+    with translation_cache_lock:
+        translation_cache_stats[name] += 1
+
+def normalize_nl_query(nl_query):
+    """Collapse whitespace and trailing punctuation so trivial variants share a cache entry"""
+    return " ".join(nl_query.split()).rstrip("?.! ")
+
+def make_translation_cache_key(nl_query, table_name, schema_fingerprint, model_name):
+    key_data = json.dumps([normalize_nl_query(nl_query), table_name, schema_fingerprint, model_name])
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+def lookup_translation(cache_key):
+    """Return the cached SQL for a key, or None if missing or expired"""
+    try:
+        conn = get_translation_cache_connection()
+        now = time.time()
+        row = conn.execute(
+            "SELECT sql_query, created_at FROM translations WHERE cache_key = ?;", (cache_key,)
+        ).fetchone()
+        if row is None:
+            count_translation_cache('misses')
+            return None
+        if now - row[1] > app.config['TRANSLATION_CACHE_TTL']:
+            conn.execute("DELETE FROM translations WHERE cache_key = ?;", (cache_key,))
+            count_translation_cache('misses')
+            return None
+        conn.execute("UPDATE translations SET last_used = ? WHERE cache_key = ?;", (now, cache_key))
+        count_translation_cache('hits')
+        return row[0]
+    except sqlite3.Error as e:
+        app.logger.warning("Translation cache lookup failed: %s", e)
+        count_translation_cache('errors')
+        return None
+
+def store_translation(cache_key, sql_query):
+    """Save a translation and evict expired and least recently used entries"""
+    try:
+        conn = get_translation_cache_connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO translations (cache_key, sql_query, created_at, last_used) VALUES (?, ?, ?, ?);",
+            (cache_key, sql_query, now, now)
+        )
+        count_translation_cache('stores')
+
+        evicted = conn.execute(
+            "DELETE FROM translations WHERE created_at < ?;", (now - app.config['TRANSLATION_CACHE_TTL'],)
+        ).rowcount
+        overflow = conn.execute("SELECT COUNT(*) FROM translations;").fetchone()[0] - app.config['TRANSLATION_CACHE_MAX_ENTRIES']
+        if overflow > 0:
+            evicted += conn.execute(
+                "DELETE FROM translations WHERE cache_key IN "
+                "(SELECT cache_key FROM translations ORDER BY last_used LIMIT ?);", (overflow,)
+            ).rowcount
+        if evicted:
+            with translation_cache_lock:
+                translation_cache_stats['evictions'] += evicted
+    except sqlite3.Error as e:
+        app.logger.warning("Translation cache store failed: %s", e)
+        count_translation_cache('errors')
+
+# Similarity store of validated question/SQL pairs, kept next to the
+# translation cache. Each schema and table has an in-memory TF-IDF index of
+# character trigrams with an inverted list, so scoring only touches examples
+# that share a trigram with the question. Paraphrases that only recase,
+# repunctuate or add filler words reuse the stored SQL directly; every other
+# match only becomes a few-shot example, since a single changed word
+# ("ascending", "northern", "inactive") or swapped pair of words ("above 30
+# ... below 50") barely moves the trigram score.
+SIMILARITY_FILLER_WORDS = {'a', 'an', 'the', 'me', 'i', 'is', 'are', 'get', 'give', 'list', 'show', 'please', 'what', 'which'}
+example_indexes = {}
+example_index_lock = threading.Lock()
+similarity_stats = {'direct': 0, 'few_shot': 0, 'stored': 0, 'evictions': 0, 'rebuilds': 0}
+
+def question_trigrams(question):
+    """Character trigram counts of a normalized question, padded at word boundaries"""
+    words = re.findall(r'\w+', normalize_nl_query(question).lower())
+    text = f" {' '.join(words)} "
+    return Counter(text[i:i + 3] for i in range(len(text) - 2))
+
+def question_words(question):
+    """Lowercase words other than filler, in order, which must match before stored SQL is reused as is"""
+    return [word for word in re.findall(r'\w+', question.lower()) if word not in SIMILARITY_FILLER_WORDS]
+
+def question_literals(question):
+    """Numbers and quoted strings in order, which must match before stored SQL is reused as is"""
+    return re.findall(r"\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"", question)
+
+def example_index_stamp(schema_fingerprint, table_name):
+    """Count and newest timestamp of the stored pairs for one schema and table, which change whenever
+    any worker stores or evicts one"""
+    return tuple(get_translation_cache_connection().execute(
+        "SELECT COUNT(*), MAX(created_at) FROM examples WHERE schema_fingerprint = ? AND table_name = ?;",
+        (schema_fingerprint, table_name)
+    ).fetchone())
+
+def build_example_index(schema_fingerprint, table_name, stamp):
+    """Load stored pairs for one schema and table and weight their trigrams by IDF"""
+    rows = get_translation_cache_connection().execute(
+        "SELECT question, sql_query FROM examples WHERE schema_fingerprint = ? AND table_name = ? AND created_at >= ? "
+        "ORDER BY created_at DESC LIMIT ?;",
+        (schema_fingerprint, table_name, time.time() - app.config['TRANSLATION_CACHE_TTL'], app.config['SIMILARITY_MAX_EXAMPLES'])
+    ).fetchall()
+    grams = [question_trigrams(question) for question, _ in rows]
+    document_frequency = Counter(gram for counts in grams for gram in counts)
+    idf = {gram: math.log((1 + len(rows)) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+
+    postings = {}
+    norms = []
+    for i, counts in enumerate(grams):
+        weights = {gram: (1 + math.log(count)) * idf[gram] for gram, count in counts.items()}
+        norms.append(math.sqrt(sum(w * w for w in weights.values())) or 1.0)
+        for gram, weight in weights.items():
+            postings.setdefault(gram, []).append((i, weight))
+    return {'examples': rows, 'idf': idf, 'postings': postings, 'norms': norms, 'stamp': stamp}
+
+def find_similar_examples(schema_fingerprint, table_name, question, limit):
+    """Stored pairs most similar to a question, as (cosine similarity, question, sql) best first"""
+    key = (schema_fingerprint, table_name)
+    with example_index_lock:
+        index = example_indexes.get(key)
+    try:
+        # Other workers store pairs in the same file, so the cached index is checked against it
+        stamp = example_index_stamp(schema_fingerprint, table_name)
+        if index is None or index['stamp'] != stamp:
+            index = build_example_index(schema_fingerprint, table_name, stamp)
+            with example_index_lock:
+                example_indexes[key] = index
+                similarity_stats['rebuilds'] += 1
+    except sqlite3.Error as e:
+        app.logger.warning("Example index build failed: %s", e)
+        return []
+    if not index['examples']:
+        return []
+
+    # Unseen trigrams cannot match any example, so they only add to the query norm
+    query = {gram: (1 + math.log(count)) * index['idf'].get(gram, math.log(1 + len(index['examples'])) + 1)
+             for gram, count in question_trigrams(question).items()}
+    query_norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+    scores = {}
+    for gram, weight in query.items():
+        for i, example_weight in index['postings'].get(gram, ()):
+            scores[i] = scores.get(i, 0.0) + weight * example_weight
+
+    best = sorted(scores, key=lambda i: -scores[i])[:limit]
+    return [(round(scores[i] / (query_norm * index['norms'][i]), 4), *index['examples'][i]) for i in best]
+
+def store_example(schema_fingerprint, table_name, question, sql_query):
+    """Remember a validated pair, evict expired and oldest pairs, and drop the in-memory index so it is rebuilt"""
+    try:
+        conn = get_translation_cache_connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO examples (schema_fingerprint, table_name, question, sql_query, created_at) "
+            "VALUES (?, ?, ?, ?, ?);", (schema_fingerprint, table_name, normalize_nl_query(question), sql_query, now)
+        )
+
+        evicted = conn.execute(
+            "DELETE FROM examples WHERE created_at < ?;", (now - app.config['TRANSLATION_CACHE_TTL'],)
+        ).rowcount
+        evicted += conn.execute(
+            "DELETE FROM examples WHERE schema_fingerprint = ? AND table_name = ? AND question NOT IN "
+            "(SELECT question FROM examples WHERE schema_fingerprint = ? AND table_name = ? ORDER BY created_at DESC LIMIT ?);",
+            (schema_fingerprint, table_name, schema_fingerprint, table_name, app.config['SIMILARITY_MAX_EXAMPLES'])
+        ).rowcount
+        overflow = conn.execute("SELECT COUNT(*) FROM examples;").fetchone()[0] - app.config['TRANSLATION_CACHE_MAX_ENTRIES']
+        if overflow > 0:
+            evicted += conn.execute(
+                "DELETE FROM examples WHERE rowid IN (SELECT rowid FROM examples ORDER BY created_at LIMIT ?);", (overflow,)
+            ).rowcount
+    except sqlite3.Error as e:
+        app.logger.warning("Example store failed: %s", e)
+        return
+    with example_index_lock:
+        example_indexes.pop((schema_fingerprint, table_name), None)
+        similarity_stats['stored'] += 1
+        similarity_stats['evictions'] += evicted
+
+def add_few_shot_examples(prompt, examples):
+    """Insert previously answered questions ahead of the question in a prompt"""
+    shots = "\n".join(f'Question: "{question}"\nSQL: {sql_query}' for _, question, sql_query in examples)
+    marker = 'Natural language query:'
+    return prompt.replace(marker, f"Examples of similar questions answered before:\n{shots}\n\n{marker}", 1)
+
+# LLM calls run on a bounded thread pool. Identical prompts already in flight
+# share one upstream call and its result instead of each paying for their own.
+llm_executor = None
+llm_in_flight = {}
+llm_lock = threading.Lock()
+llm_stats = {'calls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0, 'streams': 0}
+sql_guard_stats = {'compiled': 0, 'rejected': 0, 'repaired': 0, 'unrepaired': 0, 'repair_attempts': 0}
+
+def get_llm_executor():
+    global llm_executor
+    with llm_lock:
+        if llm_executor is None:
+            llm_executor = ThreadPoolExecutor(max_workers=app.config['LLM_MAX_CONCURRENCY'], thread_name_prefix='llm')
+        return llm_executor
+
+
+def generate_text(prompt):
+    """Generate text for a prompt on the LLM pool, returning (text, coalesced)"""
+    key = hashlib.sha256(f"{LLM_MODEL_NAME}\0{prompt}".encode('utf-8')).hexdigest()
+    executor = get_llm_executor()
+
+    with llm_lock:
+        future = llm_in_flight.get(key)
+        coalesced = future is not None
+        if coalesced:
+            llm_stats['coalesced'] += 1
+        else:
+            llm_stats['calls'] += 1
+            future = executor.submit(get_llm_backend().generate, prompt)
+            llm_in_flight[key] = future
+
+    def forget(done_future):
+        with llm_lock:
+            if llm_in_flight.get(key) is done_future:
+                del llm_in_flight[key]
+            if done_future.exception() is not None:
+                llm_stats['errors'] += 1
+
+    # Registered outside the lock: the callback runs immediately if the call already finished
+    if not coalesced:
+        future.add_done_callback(forget)
+
+    try:
+        return future.result(timeout=app.config['LLM_TIMEOUT']), coalesced
+    except FutureTimeoutError:
+        with llm_lock:
+            llm_stats['timeouts'] += 1
+        raise
+
+def stream_text(prompt):
+    """Yield generated text chunks from a streaming call on the LLM pool; closing the generator abandons the call"""
+    chunks = queue.Queue()
+    abandoned = threading.Event()
+
+    def produce():
+        try:
+            for chunk in get_llm_backend().generate_stream(prompt):
+                if abandoned.is_set():
+                    return
+                chunks.put(('chunk', chunk))
+            chunks.put(('done', None))
+        except Exception as e:
+            with llm_lock:
+                llm_stats['errors'] += 1
+            chunks.put(('error', e))
+
+    with llm_lock:
+        llm_stats['calls'] += 1
+        llm_stats['streams'] += 1
+    get_llm_executor().submit(produce)
+    try:
+        while True:
+            # LLM_TIMEOUT bounds the wait for each chunk rather than the whole answer
+            try:
+                kind, value = chunks.get(timeout=app.config['LLM_TIMEOUT'])
+            except queue.Empty:
+                with llm_lock:
+                    llm_stats['timeouts'] += 1
+                raise FutureTimeoutError()
+            if kind == 'error':
+                raise value
+            if kind == 'done':
+                return
+            yield value
+    finally:
+        abandoned.set()
+
+class FenceStripper:
+    """Apply strip_sql_fences to streamed text, holding back a tail that may be the start of a fence"""
+
+    FENCE = '```sql'
+
+    def __init__(self):
+        self.pending = ''
+        self.started = False
+
+    def feed(self, chunk):
+        text = self.pending + chunk
+        # Hold back the longest suffix that could still grow into a fence
+        hold = next((n for n in range(len(self.FENCE) - 1, 0, -1) if text.endswith(self.FENCE[:n])), 0)
+        self.pending = text[len(text) - hold:]
+        return self.emit(strip_sql_fences(text[:len(text) - hold]))
+
+    def flush(self):
+        text, self.pending = strip_sql_fences(self.pending), ''
+        return self.emit(text)
+
+    def emit(self, text):
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -99,12 +1332,17 @@ HTML_TEMPLATE = """
             <div class="card-body">
                 <div class="input-group">
                     <input type="file" id="dbFile" class="form-control" accept=".db,.sqlite,.sqlite3">
+                    <input type="text" id="dbName" class="form-control" placeholder="Name (optional)">
                     <button class="btn btn-primary" type="button" onclick="uploadDatabase()">
                         <span id="uploadSpinner" class="spinner-border spinner-border-sm d-none" role="status"></span>
                         Upload
                     </button>
                 </div>
                 <div id="uploadMessage" class="mt-2"></div>
+                <div class="input-group mt-2">
+                    <span class="input-group-text">Database</span>
+                    <select id="databaseSelect" class="form-select" onchange="selectDatabase(this.value)"></select>
+                </div>
             </div>
         </div>
 
@@ -154,6 +1392,14 @@ HTML_TEMPLATE = """
                     <span id="executeSpinner" class="spinner-border spinner-border-sm d-none" role="status"></span>
                     Execute Query
                 </button>
+                <button id="cancelButton" class="btn btn-outline-danger" style="display: none;" onclick="cancelSQL()">Cancel</button>
+                <button class="btn btn-outline-secondary ms-2" onclick="exportSQL('csv')">Export CSV</button>
+                <button class="btn btn-outline-secondary" onclick="exportSQL('jsonl')">Export JSONL</button>
+                <button class="btn btn-outline-secondary" onclick="analyzeSQL()">Analyze</button>
+                <select id="resultMode" class="form-select d-inline-block w-auto ms-2">
+                    <option value="stream">Stream all rows</option>
+                    <option value="page">Pages of 100 rows</option>
+                </select>
                 <div id="queryMessage" class="mt-2"></div>
             </div>
         </div>
@@ -173,6 +1419,10 @@ HTML_TEMPLATE = """
                 <div id="noResults" class="text-muted text-center py-3" style="display: none;">
                     No results to display
                 </div>
+                <button id="loadMoreButton" class="btn btn-outline-secondary" style="display: none;" onclick="loadNextPage()">
+                    <span id="loadMoreSpinner" class="spinner-border spinner-border-sm d-none" role="status"></span>
+                    Load more rows
+                </button>
             </div>
         </div>
     </div>
@@ -208,34 +1458,134 @@ HTML_TEMPLATE = """
                 return;
             }
 
-            const formData = new FormData();
-            formData.append("file", file);
-
             showSpinner('uploadSpinner');
 
-            fetch("/upload", { method: "POST", body: formData })
-            .then(response => response.json())
+            uploadInChunks(file)
             .then(data => {
                 hideSpinner('uploadSpinner');
                 if (data.error) {
                     showMessage('uploadMessage', data.error, 'danger');
                 } else {
                     showMessage('uploadMessage', data.message, 'success');
-                    fetchTables();
+                    selectDatabase(data.database_id);
+                    fetchDatabases();
                 }
             })
             .catch(error => {
                 hideSpinner('uploadSpinner');
-                showMessage('uploadMessage', 'Upload failed: ' + error.message, 'danger');
+                showMessage('uploadMessage', 'Upload failed: ' + error.message + ' Upload again to resume.', 'danger');
+            });
+        }
+
+        // Hash small files up front so identical uploads are skipped without sending any bytes
+        const PREHASH_MAX_BYTES = 64 * 1024 * 1024;
+
+        function hashFile(file) {
+            if (file.size > PREHASH_MAX_BYTES || !window.crypto || !crypto.subtle) {
+                return Promise.resolve(null);
+            }
+            return file.arrayBuffer()
+                .then(buffer => crypto.subtle.digest('SHA-256', buffer))
+                .then(digest => Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join(''))
+                .catch(() => null);
+        }
+
+        // Resumable upload: the session id is remembered per file so a retry continues from the server's offset
+        function uploadInChunks(file) {
+            const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+            const savedId = localStorage.getItem(resumeKey);
+            const resumed = savedId
+                ? fetch(`/upload/${savedId}`).then(response => response.ok ? response.json() : null)
+                : Promise.resolve(null);
+
+            return resumed
+            .then(session => {
+                if (session && session.status === 'receiving') return session;
+                return hashFile(file).then(sha256 => fetch("/upload/start", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ filename: file.name, size: file.size, sha256: sha256, name: document.getElementById('dbName').value })
+                }).then(response => response.json()));
+            })
+            .then(session => {
+                if (session.error || session.skipped) return session;
+                localStorage.setItem(resumeKey, session.upload_id);
+                return sendChunks(file, session);
+            })
+            .then(result => {
+                if (result.status !== 'receiving') localStorage.removeItem(resumeKey);
+                return result;
+            });
+        }
+
+        function sendChunks(file, session) {
+            if (session.error || session.status !== 'receiving') {
+                return session.status === 'validating' ? pollUpload(session.upload_id) : Promise.resolve(session);
+            }
+            const end = Math.min(session.offset + session.chunk_size, file.size);
+            showMessage('uploadMessage', `Uploading... ${Math.floor(session.offset * 100 / file.size)}%`, 'info');
+            return fetch(`/upload/${session.upload_id}?offset=${session.offset}`, {
+                method: "PUT",
+                headers: { "Content-Type": "application/octet-stream" },
+                body: file.slice(session.offset, end)
+            })
+            .then(response => response.json().then(next => {
+                // A conflict reports the offset the server actually has, so continue from there
+                if (response.status === 409 && next.status === 'receiving') {
+                    return new Promise(resolve => setTimeout(resolve, 500)).then(() => sendChunks(file, next));
+                }
+                return sendChunks(file, next);
+            }));
+        }
+
+        function pollUpload(uploadId) {
+            showMessage('uploadMessage', 'Validating database...', 'info');
+            return new Promise(resolve => setTimeout(resolve, 500))
+                .then(() => fetch(`/upload/${uploadId}`))
+                .then(response => response.json())
+                .then(session => session.status === 'validating' ? pollUpload(uploadId) : session);
+        }
+
+        let tablesData = {};
+        let currentDatabase = localStorage.getItem('database') || '';
+
+        function fetchDatabases() {
+            fetch("/databases")
+            .then(response => response.json())
+            .then(data => {
+                const databaseSelect = document.getElementById("databaseSelect");
+                databaseSelect.innerHTML = '';
+                const databases = data.databases || [];
+                if (!databases.some(db => db.database_id === currentDatabase)) {
+                    currentDatabase = data.latest || '';
+                }
+                databases.forEach(db => {
+                    const option = document.createElement("option");
+                    option.value = db.database_id;
+                    option.textContent = db.names.length ? `${db.names.join(', ')} (${db.database_id})` : db.database_id;
+                    option.selected = db.database_id === currentDatabase;
+                    databaseSelect.appendChild(option);
+                });
+                fetchTables();
+            })
+            .catch(error => {
+                console.error('Error fetching databases:', error);
             });
         }
 
+        function selectDatabase(databaseId) {
+            currentDatabase = databaseId || '';
+            localStorage.setItem('database', currentDatabase);
+            fetchTables();
+        }
+
         function fetchTables() {
-            fetch("/get-tables")
+            fetch(`/get-tables?database=${encodeURIComponent(currentDatabase)}`)
             .then(response => response.json())
             .then(data => {
+                tablesData = {};
                 const tableSelect = document.getElementById("tableSelect");
-                tableSelect.innerHTML = "<option value=''>Select a table</option>";
+                tableSelect.innerHTML = "<option value=''>Select a table</option><option value='*'>All tables (pick relevant tables automatically)</option>";
                 
                 if (data.tables && data.tables.length > 0) {
                     data.tables.forEach(table => {
@@ -257,21 +1607,39 @@ HTML_TEMPLATE = """
                 document.getElementById("tableInfo").innerHTML = '';
                 return;
             }
+            if (tableName === '*') {
+                document.getElementById("tableInfo").innerHTML =
+                    '<div class="mt-2 text-muted">The tables, columns and joins relevant to each question are chosen automatically.</div>';
+                return;
+            }
 
-            fetch("/get-tables")
-            .then(response => response.json())
-            .then(data => {
-                const tableData = data.data[tableName];
-                if (tableData) {
-                    let infoHTML = `<div class="mt-2"><strong>Table: ${tableName}</strong><br>`;
-                    infoHTML += `<strong>Columns:</strong> ${tableData.columns.map(col => col.name + ' (' + col.type + ')').join(', ')}`;
-                    infoHTML += '</div>';
-                    document.getElementById("tableInfo").innerHTML = infoHTML;
+            // Column details are fetched per table on first selection and kept until the table list reloads
+            const cached = tablesData[tableName];
+            const details = cached
+                ? Promise.resolve(cached)
+                : fetch(`/get-tables/${encodeURIComponent(tableName)}?database=${encodeURIComponent(currentDatabase)}`).then(response => response.json());
+
+            details.then(tableData => {
+                if (tableData.error) {
+                    showMessage('tableInfo', tableData.error, 'danger');
+                    return;
                 }
+                tablesData[tableName] = tableData;
+                if (document.getElementById("tableSelect").value !== tableName) return;
+                let infoHTML = `<div class="mt-2"><strong>Table: ${tableName}</strong><br>`;
+                infoHTML += `<strong>Columns:</strong> ${tableData.columns.map(col => col.name + ' (' + col.type + ')').join(', ')}`;
+                infoHTML += '</div>';
+                document.getElementById("tableInfo").innerHTML = infoHTML;
+            })
+            .catch(error => {
+                console.error('Error fetching table details:', error);
             });
         }
 
         document.getElementById("tableSelect").addEventListener('change', showTableInfo);
+        fetchDatabases();
+
+        let conversionController = null;
 
         function convertNLtoSQL() {
             const nlQuery = document.getElementById("nlQuery").value.trim();
@@ -283,32 +1651,110 @@ HTML_TEMPLATE = """
             }
 
             showSpinner('convertSpinner');
+            if (conversionController) {
+                conversionController.abort();
+            }
+            conversionController = new AbortController();
+            const controller = conversionController;
 
-            fetch("/nl-to-sql", {
+            let streamed = '';
+            const showStreamed = () => {
+                document.getElementById("sqlResult").innerHTML =
+                    `<div class="alert alert-info"><strong>Generating SQL...</strong></div>
+                     <div class="code-block" id="streamedSQL"></div>`;
+            };
+            showStreamed();
+
+            fetch("/nl-to-sql/stream", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ query: nlQuery, table: tableName })
+                body: JSON.stringify({ query: nlQuery, table: tableName, database: currentDatabase }),
+                signal: controller.signal
             })
-            .then(response => response.json())
-            .then(data => {
-                hideSpinner('convertSpinner');
-                if (data.error) {
-                    showMessage('sqlResult', data.error, 'danger');
-                } else if (data.sql_query) {
-                    document.getElementById("sqlResult").innerHTML = 
-                        `<div class="alert alert-info"><strong>Generated SQL:</strong></div>
-                         <div class="code-block">${data.sql_query}</div>`;
-                    document.getElementById("queryInput").value = data.sql_query;
-                } else {
-                    showMessage('sqlResult', 'No SQL query generated.', 'warning');
+            .then(response => {
+                if (!response.ok || !response.body) {
+                    return response.json().then(data => renderConversion(data));
                 }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                const read = () => reader.read().then(({ done, value }) => {
+                    if (done) {
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                        const message = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        const event = (message.match(/^event: (.*)$/m) || [])[1];
+                        const data = JSON.parse((message.match(/^data: (.*)$/m) || [])[1] || '{}');
+                        if (event === 'token') {
+                            if (!document.getElementById("streamedSQL")) {
+                                showStreamed();
+                            }
+                            streamed += data.text;
+                            document.getElementById("streamedSQL").textContent = streamed;
+                            hideSpinner('convertSpinner');
+                        } else if (event === 'repair') {
+                            // The streamed query did not compile and is being generated again
+                            showStreamed();
+                            streamed = '';
+                            document.getElementById("sqlResult").insertAdjacentHTML('afterbegin',
+                                `<div class="alert alert-warning">Retrying (${data.repairs}): ${data.error}</div>`);
+                        } else {
+                            renderConversion(data);
+                            return reader.cancel();
+                        }
+                    }
+                    return read();
+                });
+                return read();
             })
             .catch(error => {
+                if (error.name === 'AbortError') {
+                    return;
+                }
                 hideSpinner('convertSpinner');
                 showMessage('sqlResult', 'Conversion failed: ' + error.message, 'danger');
             });
         }
 
+        function renderConversion(data) {
+            hideSpinner('convertSpinner');
+            if (data.error) {
+                showMessage('sqlResult', data.error, 'danger');
+            } else if (data.sql_query) {
+                document.getElementById("sqlResult").innerHTML = 
+                    `<div class="alert alert-info"><strong>Generated SQL:</strong></div>
+                     <div class="code-block">${data.sql_query}</div>`;
+                document.getElementById("queryInput").value = data.sql_query;
+                const paths = {
+                    cache: 'cached answer',
+                    similar: `reused from a similar question (${data.similarity}): "${data.similar_question}"`,
+                    llm_few_shot: `generated with ${data.few_shot_examples} similar example(s)`,
+                    llm: 'generated'
+                };
+                if (data.path) {
+                    const repaired = data.repairs ? ` after ${data.repairs} repair(s)` : '';
+                    document.getElementById("sqlResult").innerHTML +=
+                        `<div class="mt-2"><small class="text-muted">Source: ${paths[data.path] || data.path}${repaired}</small></div>`;
+                }
+                if (data.tables) {
+                    document.getElementById("sqlResult").innerHTML +=
+                        `<div class="mt-2"><small class="text-muted">Tables used: ${data.tables.join(', ')}</small></div>`;
+                }
+                if (data.plan) {
+                    document.getElementById("sqlResult").innerHTML += renderPlan(data.plan, data.index_suggestions || []);
+                } else if (data.plan_error) {
+                    document.getElementById("sqlResult").innerHTML +=
+                        `<div class="alert alert-warning mt-2">Query plan unavailable: ${data.plan_error}</div>`;
+                }
+            } else {
+                showMessage('sqlResult', 'No SQL query generated.', 'warning');
+            }
+        }
+
         function executeSQL() {
             const query = document.getElementById("queryInput").value.trim();
             
@@ -318,57 +1764,269 @@ HTML_TEMPLATE = """
             }
 
             showSpinner('executeSpinner');
+            setNextPageToken(null);
+
+            const queryId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+            setRunningQuery(queryId);
+
+            const paged = document.getElementById("resultMode").value === 'page';
+            const request = paged ? { query: query, page_size: PAGE_SIZE, format: 'compact' } : { query: query, stream: true };
+            request.query_id = queryId;
+            request.database = currentDatabase;
 
             fetch("/execute", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ query: query })
+                body: JSON.stringify(request)
             })
-            .then(response => response.json())
-            .then(data => {
-                hideSpinner('executeSpinner');
-                
-                if (data.error) {
-                    showMessage('queryMessage', data.error, 'danger');
-                    hideResults();
-                } else if (data.results) {
-                    displayResults(data.results);
-                    showMessage('queryMessage', `Query executed successfully. ${data.results.length} rows returned.`, 'success');
-                } else if (data.message) {
-                    showMessage('queryMessage', data.message, 'success');
-                    hideResults();
+            .then(response => {
+                const contentType = response.headers.get('Content-Type') || '';
+                if (contentType.includes('application/x-ndjson')) {
+                    return readResultStream(response);
                 }
+                return response.json().then(data => {
+                    finishExecution();
+
+                    if (data.error) {
+                        showMessage('queryMessage', data.error, 'danger');
+                        hideResults();
+                    } else if ('next_token' in data) {
+                        displayPage(data, false);
+                    } else if (data.results) {
+                        displayResults(data.results);
+                        const note = data.truncated ? ' (row limit reached, results truncated)' : '';
+                        showMessage('queryMessage', `Query executed successfully. ${data.results.length} rows returned${note}.`, 'success');
+                    } else if (data.message) {
+                        showMessage('queryMessage', data.message, 'success');
+                        hideResults();
+                    }
+                });
             })
             .catch(error => {
-                hideSpinner('executeSpinner');
+                finishExecution();
                 showMessage('queryMessage', 'Query execution failed: ' + error.message, 'danger');
                 hideResults();
             });
         }
 
-        function displayResults(results) {
-            if (!results || results.length === 0) {
-                hideResults();
-                return;
-            }
+        const PAGE_SIZE = 100;
+        let nextPageToken = null;
+        let runningQueryId = null;
 
-            const table = document.getElementById('resultsTable');
-            const head = document.getElementById('resultHead');
-            const body = document.getElementById('resultBody');
-            const noResults = document.getElementById('noResults');
+        function setRunningQuery(queryId) {
+            runningQueryId = queryId;
+            document.getElementById('cancelButton').style.display = queryId ? 'inline-block' : 'none';
+        }
 
-            // Show table, hide no results message
-            table.style.display = 'table';
-            noResults.style.display = 'none';
+        function finishExecution() {
+            hideSpinner('executeSpinner');
+            setRunningQuery(null);
+        }
 
-            // Build header
-            const headers = Object.keys(results[0]);
-            head.innerHTML = '<tr>' + headers.map(h => `<th>${h}</th>`).join('') + '</tr>';
+        // Download the full result through a form post so it never passes through the results table
+        function exportSQL(format) {
+            const query = document.getElementById("queryInput").value.trim();
 
-            // Build body
-            body.innerHTML = results.map(row => 
-                '<tr>' + headers.map(h => `<td>${row[h] !== null ? row[h] : '<em>NULL</em>'}</td>`).join('') + '</tr>'
-            ).join('');
+            if (!query) {
+                showMessage('queryMessage', 'Please enter an SQL query.', 'warning');
+                return;
+            }
+
+            const form = document.createElement('form');
+            form.method = 'POST';
+            form.action = '/export';
+            const fields = { query: query, format: format, gzip: '1', database: currentDatabase };
+            Object.entries(fields).forEach(([name, value]) => {
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = name;
+                input.value = value;
+                form.appendChild(input);
+            });
+            document.body.appendChild(form);
+            form.submit();
+            form.remove();
+        }
+
+        function renderPlan(plan, suggestions) {
+            const steps = plan.steps.map(step => `${step.kind === 'full_scan' || step.kind === 'automatic_index' ? '&#9888; ' : ''}${step.detail}`);
+            let html = `<div class="mt-2"><strong>Query plan:</strong><div class="code-block">${steps.join('<br>')}</div></div>`;
+            if (suggestions.length) {
+                html += `<div class="mt-2"><strong>Suggested indexes:</strong>` +
+                    suggestions.map(s => `<div class="code-block">${s.sql}</div><small class="text-muted">${s.reason}${s.covering ? ', covering' : ''}</small>`).join('') +
+                    `</div>`;
+            }
+            return html;
+        }
+
+        // Show the plan and index suggestions, timing them on a scratch copy of the database
+        function analyzeSQL() {
+            const query = document.getElementById("queryInput").value.trim();
+
+            if (!query) {
+                showMessage('queryMessage', 'Please enter an SQL query.', 'warning');
+                return;
+            }
+
+            showMessage('queryMessage', 'Analyzing query plan...', 'info');
+
+            fetch("/explain", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ query: query, build_indexes: true, database: currentDatabase })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    showMessage('queryMessage', data.error, 'danger');
+                    return;
+                }
+                let html = renderPlan(data.plan, data.suggestions);
+                if (data.benchmark && data.benchmark.skipped) {
+                    html += `<div class="alert alert-info mt-2">Suggested indexes were not timed: ${data.benchmark.skipped}.</div>`;
+                } else if (data.benchmark) {
+                    html += `<div class="alert alert-success mt-2">With suggested indexes: ${data.benchmark.before_ms} ms &rarr; ${data.benchmark.after_ms} ms` +
+                        (data.benchmark.speedup ? ` (${data.benchmark.speedup}x)` : '') + `</div>`;
+                } else if (!data.suggestions.length) {
+                    html += `<div class="alert alert-info mt-2">No index suggestions for this query.</div>`;
+                }
+                document.getElementById('queryMessage').innerHTML = html;
+            })
+            .catch(error => {
+                showMessage('queryMessage', 'Query analysis failed: ' + error.message, 'danger');
+            });
+        }
+
+        function cancelSQL() {
+            if (!runningQueryId) return;
+
+            fetch(`/cancel/${encodeURIComponent(runningQueryId)}`, { method: "POST" })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    showMessage('queryMessage', data.error, 'warning');
+                }
+            });
+        }
+
+        function setNextPageToken(token) {
+            nextPageToken = token;
+            document.getElementById('loadMoreButton').style.display = token ? 'inline-block' : 'none';
+        }
+
+        // Render one page in the compact format: column names once, rows as arrays
+        function displayPage(data, append) {
+            if (!append) {
+                if (data.rows.length === 0) {
+                    hideResults();
+                } else {
+                    startResults(data.columns);
+                }
+            }
+            appendResults(data.rows);
+            setNextPageToken(data.next_token);
+
+            const estimate = data.row_count_estimate ?? '?';
+            const total = data.row_count_exact ? estimate : (data.row_count_upper_bound ? `at most ${estimate}` : `~${estimate}`);
+            showMessage('queryMessage', `Query executed successfully. Showing ${data.rows_read} of ${total} rows.`, 'success');
+        }
+
+        function loadNextPage() {
+            if (!nextPageToken) return;
+
+            showSpinner('loadMoreSpinner');
+
+            fetch("/execute", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ continuation_token: nextPageToken, page_size: PAGE_SIZE, format: 'compact' })
+            })
+            .then(response => response.json())
+            .then(data => {
+                hideSpinner('loadMoreSpinner');
+                if (data.error) {
+                    showMessage('queryMessage', data.error, 'danger');
+                    setNextPageToken(null);
+                } else {
+                    displayPage(data, true);
+                }
+            })
+            .catch(error => {
+                hideSpinner('loadMoreSpinner');
+                showMessage('queryMessage', 'Loading more rows failed: ' + error.message, 'danger');
+            });
+        }
+
+        // Read an NDJSON result stream and render each batch of rows as it arrives
+        async function readResultStream(response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let columns = [];
+
+            const handleLine = line => {
+                if (!line) return;
+                const message = JSON.parse(line);
+                if (message.columns) {
+                    columns = message.columns;
+                    startResults(columns);
+                } else if (message.rows) {
+                    appendResults(message.rows);
+                } else if (message.error) {
+                    showMessage('queryMessage', message.error, 'danger');
+                } else if (message.row_count !== undefined) {
+                    if (message.row_count === 0) {
+                        hideResults();
+                    }
+                    const note = message.truncated ? ' (row limit reached, results truncated)' : '';
+                    showMessage('queryMessage', `Query executed successfully. ${message.row_count} rows returned${note}.`, 'success');
+                }
+            };
+
+            try {
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();
+                    lines.forEach(handleLine);
+                }
+                handleLine(buffer + decoder.decode());
+            } finally {
+                finishExecution();
+            }
+        }
+
+        function startResults(headers) {
+            const table = document.getElementById('resultsTable');
+            const head = document.getElementById('resultHead');
+            const noResults = document.getElementById('noResults');
+
+            // Show table, hide no results message
+            table.style.display = 'table';
+            noResults.style.display = 'none';
+
+            head.innerHTML = '<tr>' + headers.map(h => `<th>${h}</th>`).join('') + '</tr>';
+            document.getElementById('resultBody').innerHTML = '';
+        }
+
+        function appendResults(rows) {
+            const html = rows.map(row =>
+                '<tr>' + row.map(value => `<td>${value !== null ? value : '<em>NULL</em>'}</td>`).join('') + '</tr>'
+            ).join('');
+            document.getElementById('resultBody').insertAdjacentHTML('beforeend', html);
+        }
+
+        function displayResults(results) {
+            if (!results || results.length === 0) {
+                hideResults();
+                return;
+            }
+
+            const headers = Object.keys(results[0]);
+            startResults(headers);
+            appendResults(results.map(row => headers.map(h => row[h])));
         }
 
         function hideResults() {
@@ -381,9 +2039,463 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# The page never changes while the process runs, so it is rendered and
+# compressed once and then served from memory with a validator.
+index_page = None
+index_page_lock = threading.Lock()
+
+def get_index_page():
+    global index_page
+    if index_page is None:
+        with index_page_lock:
+            if index_page is None:
+                body = render_template_string(HTML_TEMPLATE).encode('utf-8')
+                digest = hashlib.sha256(body).hexdigest()[:16]
+                compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+                index_page = {
+                    'identity': (body, f'"{digest}"'),
+                    'gzip': (compressor.compress(body) + compressor.flush(), f'"{digest}-gzip"')
+                }
+    return index_page
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    page = get_index_page()
+    encoding = 'gzip' if request.accept_encodings['gzip'] > 0 else 'identity'
+    body, etag = page[encoding]
+    headers = {
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+        'Cache-Control': f"public, max-age={app.config['INDEX_CACHE_MAX_AGE']}"
+    }
+    if encoding == 'gzip':
+        headers['Content-Encoding'] = 'gzip'
+    if request.if_none_match.contains(etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype='text/html', headers=headers)
+
+# Database workspaces. Uploads are stored content-addressed as
+# UPLOAD_FOLDER/databases/<id>.db, the id being a prefix of the file's SHA-256,
+# so identical uploads share one file. Routes take a 'database' id, or a name
+# given at upload, and default to the most recent upload. Idle databases are
+# evicted least recently used first: their warm caches and connections when the
+# estimated memory budget is exceeded, their files when the disk budget is.
+# The registry file is shared by every worker: it is reloaded whenever it
+# changes on disk and updated under an exclusive lock on registry.lock. Disk
+# eviction orders databases by the last-used time kept in the registry, which
+# each worker refreshes at most every quarter of the idle grace period, so a
+# database another worker is using, or used before a restart, is not taken as
+# the least recently used. Warm state is per process and uses local times.
+database_registry = {}
+database_last_used = {}  # abs path -> monotonic time of the last request in this worker
+database_use_written = {}  # abs path -> monotonic time this worker last wrote the shared last-used time
+workspace_lock = threading.Lock()
+workspace_stats = {'uploads': 0, 'deduplicated': 0, 'evicted_from_memory': 0, 'evicted_from_disk': 0}
+
+def get_database_dir():
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'databases')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def get_database_path(database_id):
+    return os.path.join(get_database_dir(), f"{database_id}.db")
+
+def get_registry_stamp(registry_path):
+    try:
+        stat = os.stat(registry_path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def load_database_registry(force=False):
+    """Return the registry of stored databases, reloading it when another worker changed it; call with workspace_lock held"""
+    registry_path = os.path.join(get_database_dir(), 'registry.json')
+    stamp = get_registry_stamp(registry_path)
+    if force or database_registry.get('path') != registry_path or database_registry.get('stamp') != stamp:
+        try:
+            with open(registry_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        database_registry.clear()
+        database_registry.update(path=registry_path, stamp=stamp, databases=stored.get('databases', {}),
+                                 names=stored.get('names', {}), latest=stored.get('latest'))
+    return database_registry
+
+def save_database_registry(registry):
+    temp_path = f"{registry['path']}.{secrets.token_hex(4)}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({key: registry[key] for key in ('databases', 'names', 'latest')}, f, indent=2)
+    os.replace(temp_path, registry['path'])
+    registry['stamp'] = get_registry_stamp(registry['path'])
+
+@contextmanager
+def update_database_registry():
+    """Read, modify and write the registry while holding workspace_lock and the cross-process registry lock"""
+    with workspace_lock:
+        with open(os.path.join(get_database_dir(), 'registry.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                registry = load_database_registry(force=True)
+                yield registry
+                save_database_registry(registry)
+            except BaseException:
+                database_registry.clear()  # discard partial changes; the next read reloads the file
+                raise
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def register_database(digest, name=None):
+    """Record a stored database, point the name at it and make it the default"""
+    database_id = digest[:16]
+    db_path = get_database_path(database_id)
+    with update_database_registry() as registry:
+        entry = registry['databases'].setdefault(database_id, {
+            'sha256': digest,
+            'size': os.path.getsize(db_path),
+            'uploaded': time.time(),
+            'names': []
+        })
+        entry['last_used'] = time.time()
+        if name and registry['names'].get(name) != database_id:
+            previous = registry['databases'].get(registry['names'].get(name))
+            if previous is not None:
+                previous['names'].remove(name)
+            registry['names'][name] = database_id
+            entry['names'].append(name)
+        registry['latest'] = database_id
+        database_last_used[os.path.abspath(db_path)] = time.monotonic()
+        database_use_written[os.path.abspath(db_path)] = time.monotonic()
+    return database_id
+
+def get_shared_last_used(entry):
+    """Wall-clock time any worker last used a stored database, from its registry entry"""
+    return entry.get('last_used', entry['uploaded'])
+
+def record_database_use(db_path):
+    """Note a use of a database, writing the shared last-used time when this worker's copy is stale"""
+    abs_path = os.path.abspath(db_path)
+    now = time.monotonic()
+    with workspace_lock:
+        database_last_used[abs_path] = now
+        if now - database_use_written.get(abs_path, -math.inf) < app.config['DATABASE_IDLE_GRACE'] / 4:
+            return
+        database_use_written[abs_path] = now
+    if os.path.dirname(abs_path) != os.path.abspath(get_database_dir()):
+        return  # the pre-workspace database.db has no registry entry
+    try:
+        with update_database_registry() as registry:
+            entry = registry['databases'].get(os.path.basename(abs_path)[:-len('.db')])
+            if entry is not None:
+                entry['last_used'] = time.time()
+    except OSError as e:
+        app.logger.warning("Recording database use failed: %s", e)
+
+def resolve_database(database_id=None):
+    """Map a database id or name to its file, or None if unknown; no id means the most recent upload"""
+    with workspace_lock:
+        registry = load_database_registry()
+        if not database_id:
+            database_id = registry['latest']
+            if database_id is None:
+                # Deployments from before workspaces keep serving their single database
+                return os.path.join(app.config['UPLOAD_FOLDER'], 'database.db')
+        database_id = registry['names'].get(database_id, database_id)
+        if database_id not in registry['databases']:
+            return None
+        db_path = get_database_path(database_id)
+    record_database_use(db_path)
+    return db_path
+
+def get_request_database():
+    """Resolve the 'database' of the current request, returning (db_path, error response)"""
+    data = request.get_json(silent=True) if request.is_json else None
+    database_id = str((data or {}).get('database') or request.values.get('database') or '').strip()
+    db_path = resolve_database(database_id)
+    if db_path is None:
+        return None, (jsonify({'error': f"Unknown database '{database_id}'. It may have been evicted; please upload it again."}), 404)
+    return db_path, None
+
+def estimate_database_memory(abs_path):
+    """Upper bound on memory held for a database: pooled page caches plus its cached schema"""
+    cache_size = app.config['SQLITE_CACHE_SIZE']
+    cache_bytes = -cache_size * 1024 if cache_size < 0 else cache_size * 4096
+    with connection_pool_lock:
+        connections = connection_counts.get(abs_path, 0)
+    with schema_cache_lock:
+        schema_size = schema_cache_sizes.get(abs_path, 0)
+    return connections * cache_bytes + schema_size
+
+def is_database_idle(abs_path, now):
+    """A database may be evicted once unused for the grace period and with no query or page cursor open"""
+    if now - database_last_used.get(abs_path, 0) < app.config['DATABASE_IDLE_GRACE']:
+        return False
+    with query_slots_lock:
+        slot = query_slots.get(abs_path)
+        if slot is not None and (slot['running'] or slot['waiting']):
+            return False
+    with page_cursors_lock:
+        return not any(os.path.abspath(entry['db_path']) == abs_path for entry in page_cursors.values())
+
+def evict_from_memory(abs_path):
+    """Drop a database's cached schema and have every thread close its pooled connection to it"""
+    invalidate_schema_cache(abs_path)
+    with connection_pool_lock:
+        database_generations[abs_path] = database_generations.get(abs_path, 0) + 1
+        connection_counts[abs_path] = 0
+
+def enforce_memory_budget():
+    """Evict warm state of least recently used idle databases while over the memory budget"""
+    with connection_pool_lock:
+        warm = {path for path, count in connection_counts.items() if count}
+    with schema_cache_lock:
+        warm.update(schema_cache_sizes)
+    usage = {path: estimate_database_memory(path) for path in warm}
+    total = sum(usage.values())
+    if total <= app.config['DATABASE_MEMORY_BUDGET']:
+        return
+
+    now = time.monotonic()
+    for abs_path in sorted(warm, key=lambda path: database_last_used.get(path, 0)):
+        if total <= app.config['DATABASE_MEMORY_BUDGET']:
+            break
+        if is_database_idle(abs_path, now):
+            evict_from_memory(abs_path)
+            total -= usage[abs_path]
+            with workspace_lock:
+                workspace_stats['evicted_from_memory'] += 1
+
+def remove_database(database_id):
+    """Forget a stored database and delete its file"""
+    with update_database_registry() as registry:
+        registry['databases'].pop(database_id, None)
+        registry['names'] = {name: target for name, target in registry['names'].items() if target != database_id}
+        if registry['latest'] == database_id:
+            remaining = sorted(registry['databases'], key=lambda key: registry['databases'][key]['uploaded'])
+            registry['latest'] = remaining[-1] if remaining else None
+    db_path = os.path.abspath(get_database_path(database_id))
+    evict_from_memory(db_path)
+    drop_column_profiles(db_path)
+    with workspace_lock:
+        database_last_used.pop(db_path, None)
+        database_use_written.pop(db_path, None)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+def enforce_disk_budget():
+    """Delete least recently used idle databases while stored databases exceed the disk budget"""
+    with workspace_lock:
+        databases = dict(load_database_registry()['databases'])
+    total = sum(entry['size'] for entry in databases.values())
+    now = time.monotonic()
+    wall_now = time.time()
+    for database_id in sorted(databases, key=lambda key: get_shared_last_used(databases[key])):
+        if total <= app.config['DATABASE_DISK_BUDGET']:
+            break
+        # Other workers' queries are only visible through the shared last-used time
+        if wall_now - get_shared_last_used(databases[database_id]) >= app.config['DATABASE_IDLE_GRACE'] \
+                and is_database_idle(os.path.abspath(get_database_path(database_id)), now):
+            remove_database(database_id)
+            total -= databases[database_id]['size']
+            with workspace_lock:
+                workspace_stats['evicted_from_disk'] += 1
+
+# Uploads stream into a temp file in the database store while being hashed,
+# are validated (SQLite header, PRAGMA quick_check, at least one table) and
+# are then renamed to their content address, so readers only ever see a
+# complete file. Content that is already stored is not written again.
+# Chunked upload sessions live on disk, so any worker can take the next chunk
+# and uploads resume after a restart: <id>.upload holds the bytes received so
+# far (its size is the offset) and <id>.upload.json the session metadata.
+# Writers and the validation job hold an flock on the data file.
+SQLITE_HEADER = b'SQLite format 3\x00'
+UPLOAD_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+UPLOAD_VALIDATION_GRACE = 5  # seconds before another worker retries a validation nobody holds
+upload_jobs = set()  # upload ids queued for validation in this process
+upload_lock = threading.Lock()
+upload_install_lock = threading.Lock()
+upload_executor = None
+
+def get_upload_executor():
+    global upload_executor
+    with upload_lock:
+        if upload_executor is None:
+            upload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-validate')
+        return upload_executor
+
+def find_stored_database(digest):
+    """Whether a database with this SHA-256 is already stored"""
+    with workspace_lock:
+        entry = load_database_registry()['databases'].get(digest[:16])
+    return entry is not None and entry['sha256'] == digest and os.path.exists(get_database_path(digest[:16]))
+
+def get_upload_name(value):
+    """Optional human-readable handle for an upload"""
+    name = str(value or '').strip()[:64]
+    return name or None
+
+def validate_database_file(path):
+    """Check an uploaded file is a usable SQLite database, returning (table count, error)"""
+    with open(path, 'rb') as f:
+        if f.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+            return 0, 'Invalid SQLite database file.'
+    try:
+        conn = connect_readonly(path, immutable=False)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA quick_check;").fetchall()]
+            if problems != ['ok']:
+                return 0, f"Database integrity check failed: {'; '.join(problems[:5])}"
+            tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0, 'Invalid SQLite database file.'
+    if not tables:
+        return 0, 'The uploaded file appears to be empty or contains no tables.'
+    return len(tables), None
+
+def install_database(temp_path, digest, name=None):
+    """Validate an uploaded temp file and move it to its content address, returning (payload, status)"""
+    try:
+        # PRAGMA quick_check reads the whole file, so validation runs before the lock is
+        # taken and other installs only wait for the duplicate check and the rename
+        table_count = None
+        if not find_stored_database(digest):
+            table_count, error = validate_database_file(temp_path)
+            if error:
+                return {'error': error}, 400
+
+        with upload_install_lock:
+            if find_stored_database(digest):
+                database_id = register_database(digest, name)
+                with workspace_lock:
+                    workspace_stats['deduplicated'] += 1
+                return {'message': 'Database was already uploaded; using the stored copy.', 'skipped': True,
+                        'database_id': database_id, 'sha256': digest}, 200
+
+            if table_count is None:
+                # The stored copy was evicted after the first check
+                table_count, error = validate_database_file(temp_path)
+                if error:
+                    return {'error': error}, 400
+
+            os.replace(temp_path, get_database_path(digest[:16]))
+            database_id = register_database(digest, name)
+            schedule_column_profile(get_database_path(database_id))
+            with workspace_lock:
+                workspace_stats['uploads'] += 1
+        enforce_disk_budget()
+        return {'message': f'Database uploaded successfully with {table_count} tables.',
+                'database_id': database_id, 'sha256': digest}, 200
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def get_upload_session_paths(upload_id):
+    """Data and metadata paths of a chunked upload, or None for an id that is not a session token"""
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', upload_id):
+        return None
+    temp_path = os.path.join(get_database_dir(), f"{upload_id}.upload")
+    return temp_path, f"{temp_path}.json"
+
+def load_upload_session(upload_id):
+    """Read a chunked upload's metadata and current offset, or None if unknown"""
+    paths = get_upload_session_paths(upload_id)
+    if paths is None:
+        return None
+    try:
+        with open(paths[1]) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    session.update(temp_path=paths[0], meta_path=paths[1])
+    try:
+        session['received'] = os.path.getsize(paths[0])
+    except OSError:
+        session['received'] = session['size'] if session['status'] != 'receiving' else 0
+    return session
+
+def save_upload_session(session):
+    fields = ('name', 'size', 'status', 'result', 'updated')
+    temp_path = f"{session['meta_path']}.{secrets.token_hex(4)}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({key: session.get(key) for key in fields}, f)
+    os.replace(temp_path, session['meta_path'])
+
+def try_lock_upload(f):
+    """Take the exclusive lock on an open upload data file without waiting"""
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def queue_upload_validation(upload_id):
+    with upload_lock:
+        if upload_id in upload_jobs:
+            return
+        upload_jobs.add(upload_id)
+    get_upload_executor().submit(validate_upload_session, upload_id)
+
+def validate_upload_session(upload_id):
+    """Background job: hash and validate a fully received chunked upload and install it"""
+    try:
+        session = load_upload_session(upload_id)
+        if session is None or session['status'] != 'validating':
+            return
+        try:
+            f = open(session['temp_path'], 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            # Another worker may already be validating the same session
+            if not try_lock_upload(f):
+                return
+            session = load_upload_session(upload_id)
+            if session['status'] != 'validating':
+                return
+            try:
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                payload, status = install_database(session['temp_path'], digest.hexdigest(), session['name'])
+            except Exception as e:
+                payload, status = {'error': f'Upload failed: {str(e)}'}, 500
+            session['result'] = payload
+            session['status'] = 'failed' if status >= 400 else ('skipped' if payload.get('skipped') else 'complete')
+            session['updated'] = time.time()
+            save_upload_session(session)
+    finally:
+        with upload_lock:
+            upload_jobs.discard(upload_id)
+
+def remove_upload_session(session):
+    for path in (session['temp_path'], session['meta_path']):
+        if os.path.exists(path):
+            os.remove(path)
+
+def expire_upload_sessions():
+    """Drop chunked uploads that have been idle longer than the session timeout"""
+    now = time.time()
+    for filename in os.listdir(get_database_dir()):
+        if not filename.endswith('.upload.json'):
+            continue
+        session = load_upload_session(filename[:-len('.upload.json')])
+        if session is not None and now - session['updated'] > app.config['UPLOAD_SESSION_TIMEOUT'] \
+                and session['status'] != 'validating':
+            remove_upload_session(session)
+
+def describe_upload_session(upload_id, session):
+    payload = {
+        'upload_id': upload_id,
+        'status': session['status'],
+        'offset': session['received'],
+        'size': session['size'],
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
+    }
+    if session.get('result'):
+        payload.update(session['result'])
+    return payload
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -395,83 +2507,316 @@ def upload_file():
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
         
-        if file and file.filename.lower().endswith(('.db', '.sqlite', '.sqlite3')):
-            filename = secure_filename('database.db')
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Verify it's a valid SQLite database
-            try:
-                conn = sqlite3.connect(file_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = cursor.fetchall()
-                conn.close()
-                
-                if not tables:
-                    os.remove(file_path)
-                    return jsonify({'error': 'The uploaded file appears to be empty or contains no tables.'}), 400
-                
-                return jsonify({'message': f'Database uploaded successfully with {len(tables)} tables.'})
-                
-            except sqlite3.Error:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return jsonify({'error': 'Invalid SQLite database file.'}), 400
+        if file and file.filename.lower().endswith(UPLOAD_EXTENSIONS):
+            # Stream into the store while hashing and move it into place only once validated,
+            # so pooled connections never see a half-written or truncated file
+            temp_path = os.path.join(get_database_dir(), f"{secrets.token_hex(8)}.upload")
+            digest = hashlib.sha256()
+            with open(temp_path, 'wb') as f:
+                for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            payload, status = install_database(temp_path, digest.hexdigest(), get_upload_name(request.form.get('name')))
+            return jsonify(payload), status
         
         return jsonify({'error': 'Please upload a valid SQLite database file (.db, .sqlite, .sqlite3).'}), 400
         
     except Exception as e:
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
+@app.route('/upload/start', methods=['POST'])
+def start_chunked_upload():
+    """Begin a resumable upload; chunks are then sent in order with PUT /upload/<id>"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = str(data.get('filename', ''))
+        size = data.get('size')
+        sha256 = str(data.get('sha256') or '').lower()
+
+        if not filename.lower().endswith(UPLOAD_EXTENSIONS):
+            return jsonify({'error': 'Please upload a valid SQLite database file (.db, .sqlite, .sqlite3).'}), 400
+        if not isinstance(size, int) or size <= 0:
+            return jsonify({'error': "'size' must be a positive number of bytes"}), 400
+        if size > app.config['UPLOAD_MAX_SIZE']:
+            return jsonify({'error': f"Upload exceeds the maximum size of {app.config['UPLOAD_MAX_SIZE']} bytes"}), 413
+
+        # A client that already knows the content hash can skip sending stored bytes
+        name = get_upload_name(data.get('name'))
+        if re.fullmatch(r'[0-9a-f]{64}', sha256) and find_stored_database(sha256):
+            database_id = register_database(sha256, name)
+            with workspace_lock:
+                workspace_stats['deduplicated'] += 1
+            return jsonify({'status': 'skipped', 'skipped': True, 'database_id': database_id, 'sha256': sha256,
+                            'message': 'Database was already uploaded; using the stored copy.'})
+
+        expire_upload_sessions()
+        upload_id = secrets.token_urlsafe(16)
+        temp_path, meta_path = get_upload_session_paths(upload_id)
+        session = {
+            'temp_path': temp_path,
+            'meta_path': meta_path,
+            'name': name,
+            'size': size,
+            'received': 0,
+            'status': 'receiving',
+            'result': None,
+            'updated': time.time()
+        }
+        open(temp_path, 'wb').close()
+        save_upload_session(session)
+        return jsonify(describe_upload_session(upload_id, session))
+
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """Report progress so an interrupted client can resume from 'offset'"""
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired upload'}), 404
+
+    # Pick up a validation whose worker went away before finishing it
+    if session['status'] == 'validating' and time.time() - session['updated'] > UPLOAD_VALIDATION_GRACE:
+        try:
+            with open(session['temp_path'], 'rb') as f:
+                abandoned = try_lock_upload(f)
+        except FileNotFoundError:
+            abandoned = False
+        if abandoned:
+            queue_upload_validation(upload_id)
+    return jsonify(describe_upload_session(upload_id, session))
+
+@app.route('/upload/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """Append one chunk at ?offset=N; the last chunk starts background validation"""
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired upload'}), 404
+
+    try:
+        offset = int(request.args.get('offset', '-1'))
+    except ValueError:
+        return jsonify({'error': "'offset' must be an integer"}), 400
+
+    try:
+        with open(session['temp_path'], 'r+b') as f:
+            # One writer per session across workers; a retried chunk racing its original must not interleave
+            if not try_lock_upload(f):
+                return jsonify(dict(describe_upload_session(upload_id, session), error='Another chunk for this upload is in progress')), 409
+            session = load_upload_session(upload_id)
+            if session['status'] != 'receiving':
+                return jsonify(describe_upload_session(upload_id, session))
+            if offset != session['received']:
+                return jsonify(dict(describe_upload_session(upload_id, session), error=f"Expected offset {session['received']}")), 409
+
+            limit = min(app.config['UPLOAD_CHUNK_SIZE'], session['size'] - session['received'])
+            chunk = request.stream.read(limit + 1)
+            if len(chunk) > limit:
+                return jsonify(dict(describe_upload_session(upload_id, session), error=f'Chunk exceeds {limit} bytes')), 413
+
+            f.seek(offset)
+            f.write(chunk)
+            f.truncate()
+            session['received'] += len(chunk)
+            session['updated'] = time.time()
+            if session['received'] == session['size']:
+                session['status'] = 'validating'
+            save_upload_session(session)
+
+        # Validation takes the file lock itself, so it starts once this writer has let go
+        if session['status'] == 'validating':
+            queue_upload_validation(upload_id)
+        return jsonify(describe_upload_session(upload_id, session))
+
+    except FileNotFoundError:
+        return jsonify({'error': 'Unknown or expired upload'}), 404
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@app.route('/upload/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    session = load_upload_session(upload_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired upload'}), 404
+    if session['status'] == 'validating':
+        return jsonify({'error': 'Upload is already being validated'}), 409
+    remove_upload_session(session)
+    return jsonify({'upload_id': upload_id, 'status': 'aborted'})
+
+@app.route('/databases', methods=['GET'])
+def list_databases():
+    now = time.monotonic()
+    wall_now = time.time()
+    with workspace_lock:
+        registry = load_database_registry()
+        databases = {key: dict(entry) for key, entry in registry['databases'].items()}
+        latest = registry['latest']
+    result = []
+    for database_id, entry in sorted(databases.items(), key=lambda item: -item[1]['uploaded']):
+        abs_path = os.path.abspath(get_database_path(database_id))
+        idle_seconds = wall_now - get_shared_last_used(entry)
+        if abs_path in database_last_used:
+            idle_seconds = min(idle_seconds, now - database_last_used[abs_path])
+        result.append({
+            'database_id': database_id,
+            'names': entry['names'],
+            'size': entry['size'],
+            'uploaded': entry['uploaded'],
+            'idle_seconds': round(max(0.0, idle_seconds), 1),
+            'memory_estimate': estimate_database_memory(abs_path)
+        })
+    return jsonify({'databases': result, 'latest': latest})
+
+@app.route('/databases/<database_id>', methods=['DELETE'])
+def delete_database(database_id):
+    db_path = resolve_database(database_id)
+    if db_path is None or os.path.dirname(os.path.abspath(db_path)) != os.path.abspath(get_database_dir()):
+        return jsonify({'error': f"Unknown database '{database_id}'"}), 404
+
+    abs_path = os.path.abspath(db_path)
+    # Deleting ignores the idle grace period but never pulls a file out from under a running query
+    # in this worker. Queries in other workers keep reading the unlinked file through their open
+    # connections; their next request for the database gets a 404.
+    with query_slots_lock:
+        slot = query_slots.get(abs_path)
+        busy = slot is not None and (slot['running'] or slot['waiting'])
+    with page_cursors_lock:
+        busy = busy or any(os.path.abspath(entry['db_path']) == abs_path for entry in page_cursors.values())
+    if busy:
+        return jsonify({'error': 'Database has running queries; try again once they finish.'}), 409
+
+    database_id = os.path.basename(db_path)[:-len('.db')]
+    remove_database(database_id)
+    return jsonify({'database_id': database_id, 'status': 'deleted'})
+
 @app.route('/get-tables', methods=['GET'])
 def get_tables():
     try:
-        db_path = os.path.join(app.config['UPLOAD_FOLDER'], 'database.db')
-        database_info = get_database_info(db_path)
+        db_path, error = get_request_database()
+        if error:
+            return error
+        with timed_stage('introspect'):
+            database_info = get_database_info(db_path)
         
         if isinstance(database_info, dict) and 'error' in database_info:
             return jsonify(database_info), 400
-            
-        return jsonify(database_info)
+        if not isinstance(database_info, dict):
+            return jsonify(database_info)
+
+        # Names only; columns and samples come from /get-tables/<table> when a table is picked
+        with timed_stage('serialize'):
+            return jsonify({
+                'tables': database_info['tables'],
+                'views': [name for name in database_info['tables'] if database_info['data'][name]['type'] == 'view'],
+                'fingerprint': database_info['fingerprint']
+            })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/nl-to-sql', methods=['POST'])
-def nl_to_sql():
+@app.route('/get-tables/<path:table_name>', methods=['GET'])
+def get_table(table_name):
     try:
-        data = request.json
-        nl_query = data.get("query", "").strip()
-        table_name = data.get("table", "").strip()
+        blob_mode = request.args.get('blobs', 'base64')
+        if blob_mode not in BLOB_MODES:
+            return jsonify({'error': f"blobs must be one of: {', '.join(BLOB_MODES)}"}), 400
 
-        if not nl_query:
-            return jsonify({"error": "No query provided"}), 400
-
-        if not table_name:
-            return jsonify({"error": "Please select a table"}), 400
+        db_path, error = get_request_database()
+        if error:
+            return error
+        with timed_stage('introspect'):
+            database_info = get_database_info(db_path)
 
-        db_path = os.path.join(app.config['UPLOAD_FOLDER'], 'database.db')
-        database_info = get_database_info(db_path)
-        
         if isinstance(database_info, dict) and 'error' in database_info:
             return jsonify(database_info), 400
-        
-        # Get specific table information
-        table_data = database_info['data'].get(table_name)
-        if not table_data:
-            return jsonify({"error": f"Table '{table_name}' not found"}), 400
-        
-        # Build a focused prompt for the selected table
-        columns_info = ", ".join([f"{col['name']} ({col['type']})" for col in table_data['columns']])
-        
-        # Format sample data for context
-        sample_data_str = ""
-        if table_data['sample_data']:
-            sample_data_str = "Sample data:\n"
-            for i, row in enumerate(table_data['sample_data'][:3]):
-                sample_data_str += f"Row {i+1}: {row}\n"
-
-        prompt = f"""
+        if not isinstance(database_info, dict):
+            return jsonify({'error': 'Database file not found. Please upload a database first.'}), 400
+
+        table = get_table_details(db_path, database_info, table_name)
+        if table is None:
+            return jsonify({'error': f"Table '{table_name}' not found"}), 404
+        # Samples are cached as read, so BLOB values are encoded for JSON on the way out
+        samples = encode_blobs([tuple(row.values()) for row in table['sample_data']], blob_mode)
+        table = dict(table, sample_data=[dict(zip(row, values)) for row, values in zip(table['sample_data'], samples)])
+        profile = get_column_profile(db_path, database_info['fingerprint'])
+        if profile and table_name in profile:
+            table = dict(table, column_stats=profile[table_name])
+
+        with timed_stage('serialize'):
+            return jsonify(table)
+    except sqlite3.Error as e:
+        return jsonify({'error': f'SQL Error: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled. Set METRICS_ENABLED=1 to enable them.'}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    with schema_cache_lock:
+        schema_stats = dict(schema_cache_stats, entries=len(schema_cache))
+    with translation_cache_lock:
+        translation_stats = dict(translation_cache_stats)
+    try:
+        translation_stats['entries'] = get_translation_cache_connection().execute(
+            "SELECT COUNT(*) FROM translations;"
+        ).fetchone()[0]
+    except sqlite3.Error:
+        translation_stats['entries'] = None
+    with connection_pool_lock:
+        pool_stats = dict(connection_pool_stats)
+    with llm_lock:
+        generation_stats = dict(llm_stats, in_flight=len(llm_in_flight), backend=LLM_BACKEND_NAME,
+                                loaded=llm_backend is not None, **llm_startup)
+        guard_stats = dict(sql_guard_stats)
+    with query_slots_lock:
+        scheduler_stats = dict(query_scheduler_stats, queued_now=sum(slot['waiting'] for slot in query_slots.values()))
+    with running_queries_lock:
+        scheduler_stats['running'] = len(running_queries)
+    with workspace_lock:
+        workspaces = dict(workspace_stats, stored=len(load_database_registry()['databases']))
+    with example_index_lock:
+        example_stats = dict(similarity_stats)
+    try:
+        example_stats['entries'] = get_translation_cache_connection().execute("SELECT COUNT(*) FROM examples;").fetchone()[0]
+    except sqlite3.Error:
+        example_stats['entries'] = None
+    with profiler_lock:
+        profile_stats = dict(profiler_stats, seconds=round(profiler_stats['seconds'], 3),
+                             pending=len(profiles_pending), profiles=len(column_profiles))
+    return jsonify({
+        'profiler': profile_stats,
+        'similarity': example_stats,
+        'sql_guard': guard_stats,
+        'workspaces': workspaces,
+        'schema_cache': schema_stats,
+        'translation_cache': translation_stats,
+        'connection_pool': pool_stats,
+        'query_scheduler': scheduler_stats,
+        'llm': generation_stats
+    })
+
+def build_table_prompt(nl_query, table_name, table_data, table_profile=None):
+    """Build a focused prompt for the selected table"""
+    columns_info = ", ".join([f"{col['name']} ({col['type']})" for col in table_data['columns']])
+    
+    # Format sample data for context
+    sample_data_str = ""
+    if table_data['sample_data']:
+        sample_data_str = "Sample data:\n"
+        for i, row in enumerate(table_data['sample_data'][:3]):
+            sample_data_str += f"Row {i+1}: {row}\n"
+
+    # Precomputed statistics give the model real literal values and their casing
+    if table_profile:
+        sample_data_str += f"\nColumn statistics (from {table_profile['sampled_rows']} sampled rows):\n{format_column_stats(table_profile)}\n"
+
+    return f"""
 Convert the following natural language query to a valid SQLite SQL query.
 
 Table: {table_name}
@@ -493,64 +2838,1421 @@ Instructions:
 SQL Query:
 """
 
+def build_schema_prompt(nl_query, selection, index, profile=None):
+    """Build a prompt over the tables and columns selected for a multi-table question"""
+    sections = []
+    for table_name in selection['tables']:
+        table = index['tables'][table_name]
+        columns = selection['columns'][table_name]
+        described = []
+        for col in columns:
+            notes = [col['type']] if col['type'] else []
+            if col['name'] in table['primary_key']:
+                notes.append('primary key')
+            described.append(f"{col['name']} ({', '.join(notes)})" if notes else col['name'])
+        section = f"Table: {table_name}\nColumns: {', '.join(described)}"
+        hidden = len(table['columns']) - len(columns)
+        if hidden > 0:
+            section += f" (+{hidden} more columns not relevant here)"
+
+        # Frequent values of the included columns give the model exact literals
+        table_profile = (profile or {}).get(table_name, {}).get('columns', {})
+        values = [f"{col['name']}: " + ", ".join(repr(value) for value, _ in table_profile[col['name']]['top_values'])
+                  for col in columns if 'top_values' in table_profile.get(col['name'], {})]
+        if values:
+            section += "\nValues: " + "; ".join(values)
+        sections.append(section)
+
+    tables_info = "\n\n".join(sections)
+    relationships = "\n".join(f"- {table}.{column} = {other}.{other_column}"
+                               for table, column, other, other_column in selection['relationships'])
+
+    return f"""
+Convert the following natural language query to a valid SQLite SQL query.
+
+{tables_info}
+
+Relationships:
+{relationships or "- none"}
+
+Natural language query: "{nl_query}"
+
+Instructions:
+- Generate ONLY the SQL query, no explanations
+- Use proper SQLite syntax
+- Use only the tables and columns listed above, with their exact names
+- Join tables on the relationships listed above
+- Include appropriate WHERE, ORDER BY, GROUP BY clauses as needed
+- For aggregations, use proper GROUP BY
+- Limit results to reasonable numbers (e.g., LIMIT 100) for large result sets
+
+SQL Query:
+"""
+
+def prepare_translation(nl_query, table_name, db_path, database_info):
+    """Answer a question from the caches or build its prompt, returning (payload, status, context)"""
+    if table_name != MULTI_TABLE and table_name not in database_info['data']:
+        return {"error": f"Table '{table_name}' not found"}, 400, None
+    
+    # Serve repeated questions against an unchanged schema from the translation cache
+    lookup_start = time.perf_counter()
+    with timed_stage('cache'):
+        cache_key = make_translation_cache_key(nl_query, table_name, database_info['fingerprint'], LLM_MODEL_NAME)
+        cached_sql = lookup_translation(cache_key)
+    lookup_ms = round((time.perf_counter() - lookup_start) * 1000, 3)
+    if cached_sql is not None:
+        return {"sql_query": cached_sql, "cached": True, "path": "cache", "cache_lookup_ms": lookup_ms}, 200, None
+
+    # A reworded copy of a validated question reuses its SQL; other matches become examples.
+    # Direct hits are not written to the translation cache, so a wrong reuse is never pinned.
+    with timed_stage('similar'):
+        similar = find_similar_examples(database_info['fingerprint'], table_name, nl_query, app.config['SIMILARITY_FEW_SHOT_EXAMPLES'])
+    if similar and similar[0][0] >= app.config['SIMILARITY_DIRECT_THRESHOLD'] \
+            and question_words(similar[0][1]) == question_words(nl_query) \
+            and question_literals(similar[0][1]) == question_literals(nl_query):
+        similarity, similar_question, sql_query = similar[0]
+        with example_index_lock:
+            similarity_stats['direct'] += 1
+        return {"sql_query": sql_query, "cached": False, "path": "similar", "similarity": similarity,
+                "similar_question": similar_question, "cache_lookup_ms": lookup_ms}, 200, None
+    examples = [example for example in similar if example[0] >= app.config['SIMILARITY_FEW_SHOT_THRESHOLD']]
+
+    selection = None
+    with timed_stage('prompt'):
+        profile = get_column_profile(db_path, database_info['fingerprint'])
+        if table_name == MULTI_TABLE:
+            try:
+                index = get_schema_index(db_path, database_info)
+            except sqlite3.Error as e:
+                return {"error": f"Error indexing schema: {str(e)}"}, 400, None
+            selection = select_relevant_schema(index, nl_query)
+            if selection is None:
+                return {"error": "No tables match this question. Mention a table or column name, or select a table."}, 400, None
+            prompt = build_schema_prompt(nl_query, selection, index, profile)
+        else:
+            try:
+                table_data = get_table_details(db_path, database_info, table_name)
+            except sqlite3.Error as e:
+                return {"error": f"Error reading table '{table_name}': {str(e)}"}, 400, None
+            prompt = build_table_prompt(nl_query, table_name, table_data, (profile or {}).get(table_name))
+        if examples:
+            prompt = add_few_shot_examples(prompt, examples)
+
+    return None, None, {
+        'nl_query': nl_query,
+        'table_name': table_name,
+        'db_path': db_path,
+        'database_info': database_info,
+        'cache_key': cache_key,
+        'lookup_ms': lookup_ms,
+        'examples': examples,
+        'selection': selection,
+        'prompt': prompt
+    }
+
+def strip_sql_fences(text):
+    return text.replace('```sql', '').replace('```', '')
+
+def finish_translation(context, sql_query, attempts, coalesced, repairs=0):
+    """Clean up generated text, compile it against the database and store it, returning (payload, status)"""
+    with timed_stage('cleanup'):
+        # Clean up the response - remove any markdown formatting
+        sql_query = strip_sql_fences(sql_query.strip()).strip()
+
+    # Only a single read-only statement that compiles against this schema is returned or kept for reuse
+    with timed_stage('compile'):
         try:
-            response = model.generate_content(prompt)
-            sql_query = response.text.strip()
-            
-            # Clean up the response - remove any markdown formatting
-            sql_query = sql_query.replace('```sql', '').replace('```', '').strip()
-            
-            # Basic validation
-            if not sql_query.lower().startswith(('select', 'insert', 'update', 'delete')):
-                return jsonify({"error": "Generated query doesn't appear to be valid SQL"}), 400
-            
-            return jsonify({"sql_query": sql_query})
+            compile_read_only(get_pooled_connection(context['db_path']), sql_query)
+        except sqlite3.Error as e:
+            with llm_lock:
+                sql_guard_stats['rejected'] += 1
+            compile_error = str(e)
+            if is_authorization_error(e):
+                compile_error = f"{compile_error} (only read-only SELECT statements are allowed)"
+            return {"error": f"Generated query failed validation: {compile_error}", "sql_query": sql_query,
+                    "compile_error": compile_error, "attempts": attempts, "repairs": repairs}, 400
+        with llm_lock:
+            sql_guard_stats['compiled'] += 1
+
+    store_translation(context['cache_key'], sql_query)
+    store_example(context['database_info']['fingerprint'], context['table_name'], context['nl_query'], sql_query)
+    if context['examples']:
+        with example_index_lock:
+            similarity_stats['few_shot'] += 1
+    payload = {"sql_query": sql_query, "cached": False, "coalesced": coalesced, "attempts": attempts,
+               "repairs": repairs, "cache_lookup_ms": context['lookup_ms'], "prompt_chars": len(context['prompt']),
+               "path": "llm_few_shot" if context['examples'] else "llm", "few_shot_examples": len(context['examples'])}
+    if context['selection'] is not None:
+        payload.update(tables=context['selection']['tables'], table_scores=context['selection']['scores'])
+    return payload, 200
+
+def build_repair_prompt(prompt, sql_query, compile_error):
+    """Extend a prompt with the previous answer and the error SQLite reported for it"""
+    return f"""{prompt}{sql_query}
+
+The query above is invalid for this database. SQLite reported: {compile_error}
+Write a corrected query. Return ONLY the SQL query, without any explanations or markdown formatting.
+
+SQL Query:
+"""
+
+def record_repair_outcome(repairs, status):
+    if not repairs:
+        return
+    with llm_lock:
+        sql_guard_stats['repair_attempts'] += repairs
+        sql_guard_stats['repaired' if status == 200 else 'unrepaired'] += 1
+
+def translate_nl_query(nl_query, table_name, db_path, database_info, max_retries=0):
+    """Translate one question against an already introspected database, returning (payload, status)"""
+    payload, status, context = prepare_translation(nl_query, table_name, db_path, database_info)
+    if context is None:
+        return payload, status
+
+    prompt = context['prompt']
+    attempts = 0
+    repairs = 0
+    while True:
+        # Retry failed generation calls with exponential backoff and jitter
+        failures = 0
+        while True:
+            attempts += 1
+            try:
+                with timed_stage('llm'):
+                    sql_query, coalesced = generate_text(prompt)
+                break
+            except FutureTimeoutError:
+                failures += 1
+                if failures > max_retries:
+                    record_repair_outcome(repairs, 504)
+                    return {"error": f"SQL generation timed out after {app.config['LLM_TIMEOUT']:g} seconds", "attempts": attempts, "repairs": repairs}, 504
+            except Exception as e:
+                failures += 1
+                if failures > max_retries:
+                    record_repair_outcome(repairs, 500)
+                    return {"error": f"Failed to generate SQL query: {str(e)}", "attempts": attempts, "repairs": repairs}, 500
+            time.sleep(app.config['LLM_RETRY_BACKOFF'] * (2 ** (failures - 1)) * (0.5 + random.random()))
+
+        # SQL that does not compile goes back to the model with the error, a bounded number of times
+        payload, status = finish_translation(context, sql_query, attempts, coalesced, repairs)
+        if 'compile_error' not in payload or repairs >= app.config['SQL_REPAIR_ATTEMPTS']:
+            break
+        repairs += 1
+        prompt = build_repair_prompt(context['prompt'], payload['sql_query'], payload['compile_error'])
+
+    record_repair_outcome(repairs, status)
+    return payload, status
+
+@app.route('/nl-to-sql', methods=['POST'])
+def nl_to_sql():
+    try:
+        data = request.json
+        nl_query = data.get("query", "").strip()
+        table_name = data.get("table", "").strip()
+
+        if not nl_query:
+            return jsonify({"error": "No query provided"}), 400
+
+        if not table_name:
+            return jsonify({"error": "Please select a table"}), 400
+
+        db_path, error = get_request_database()
+        if error:
+            return error
+        with timed_stage('introspect'):
+            database_info = get_database_info(db_path)
+        
+        if isinstance(database_info, dict) and 'error' in database_info:
+            return jsonify(database_info), 400
+        
+        payload, status = translate_nl_query(nl_query, table_name, db_path, database_info)
+        if status == 200:
+            payload = attach_query_plan(payload, db_path, database_info)
+        with timed_stage('serialize'):
+            return jsonify(payload), status
             
+    except Exception as e:
+        return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
+
+def attach_query_plan(payload, db_path, database_info):
+    """Add the query plan and index suggestions for generated queries"""
+    with timed_stage('plan'):
+        try:
+            conn = get_pooled_connection(db_path)
+            plan = summarize_query_plan(conn, payload['sql_query'])
+            return dict(payload, plan=plan, index_suggestions=suggest_indexes(conn, payload['sql_query'], plan, database_info))
+        except sqlite3.Error as e:
+            return dict(payload, plan_error=str(e))
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def stream_translation(payload, status, context, db_path, database_info):
+    """Yield SSE events: token events as SQL is generated, then one done or error event"""
+    if context is None:
+        if status == 200:
+            yield sse_event('token', {'text': payload['sql_query']})
+            payload = attach_query_plan(payload, db_path, database_info)
+            yield sse_event('done', dict(payload, status=status))
+        else:
+            yield sse_event('error', dict(payload, status=status))
+        return
+
+    prompt = context['prompt']
+    repairs = 0
+    started = time.perf_counter()
+    while True:
+        stripper = FenceStripper()
+        parts = []
+        try:
+            for chunk in stream_text(prompt):
+                text = stripper.feed(chunk)
+                if text:
+                    if not parts and not repairs and app.config['METRICS_ENABLED']:
+                        observe_metric('nl2sql_llm_first_token_seconds', time.perf_counter() - started)
+                    parts.append(text)
+                    yield sse_event('token', {'text': text})
+            text = stripper.flush()
+            if text:
+                parts.append(text)
+                yield sse_event('token', {'text': text})
+        except FutureTimeoutError:
+            record_repair_outcome(repairs, 504)
+            yield sse_event('error', {'error': f"SQL generation timed out after {app.config['LLM_TIMEOUT']:g} seconds", 'repairs': repairs, 'status': 504})
+            return
         except Exception as e:
-            return jsonify({"error": f"Failed to generate SQL query: {str(e)}"}), 500
-            
+            record_repair_outcome(repairs, 500)
+            yield sse_event('error', {'error': f"Failed to generate SQL query: {str(e)}", 'repairs': repairs, 'status': 500})
+            return
+
+        # Streamed SQL that does not compile is discarded and generated again with the error
+        payload, status = finish_translation(context, ''.join(parts), repairs + 1, False, repairs)
+        if 'compile_error' not in payload or repairs >= app.config['SQL_REPAIR_ATTEMPTS']:
+            break
+        repairs += 1
+        yield sse_event('repair', {'error': payload['compile_error'], 'repairs': repairs})
+        prompt = build_repair_prompt(context['prompt'], payload['sql_query'], payload['compile_error'])
+
+    # The final event carries the same validated payload as /nl-to-sql
+    record_repair_outcome(repairs, status)
+    if status == 200:
+        payload = attach_query_plan(payload, db_path, database_info)
+    yield sse_event('done' if status == 200 else 'error', dict(payload, status=status))
+
+@app.route('/nl-to-sql/stream', methods=['GET', 'POST'])
+def nl_to_sql_stream():
+    """Like /nl-to-sql, but streams the SQL as Server-Sent Events while it is generated"""
+    try:
+        data = request.get_json(silent=True) or request.args
+        nl_query = str(data.get("query", "")).strip()
+        table_name = str(data.get("table", "")).strip()
+
+        if not nl_query:
+            return jsonify({"error": "No query provided"}), 400
+
+        if not table_name:
+            return jsonify({"error": "Please select a table"}), 400
+
+        db_path, error = get_request_database()
+        if error:
+            return error
+        with timed_stage('introspect'):
+            database_info = get_database_info(db_path)
+
+        if isinstance(database_info, dict) and 'error' in database_info:
+            return jsonify(database_info), 400
+        if not isinstance(database_info, dict):
+            return jsonify({"error": "Database file not found. Please upload a database first."}), 400
+
+        payload, status, context = prepare_translation(nl_query, table_name, db_path, database_info)
+        return Response(
+            stream_translation(payload, status, context, db_path, database_info),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    except Exception as e:
+        return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
+
+def translate_batch_item(index, item, db_path, database_info):
+    """Translate one batch item, turning any failure into an error line for that item only"""
+    result = {"index": index}
+    try:
+        if not isinstance(item, dict):
+            return dict(result, error="Each item must be an object with 'query' and 'table'")
+        nl_query = str(item.get("query", "")).strip()
+        table_name = str(item.get("table", "")).strip()
+        result.update(query=nl_query, table=table_name)
+        if not nl_query:
+            return dict(result, error="No query provided")
+        if not table_name:
+            return dict(result, error="No table provided")
+
+        payload, status = translate_nl_query(nl_query, table_name, db_path, database_info, app.config['LLM_MAX_RETRIES'])
+        return dict(result, status=status, **payload)
+    except Exception as e:
+        return dict(result, error=f"Request processing failed: {str(e)}")
+
+def stream_batch_results(items, db_path, database_info):
+    """Yield one NDJSON line per item as its translation completes, then a summary line"""
+    executor = ThreadPoolExecutor(max_workers=app.config['BATCH_CONCURRENCY'], thread_name_prefix='batch')
+    succeeded = failed = 0
+    try:
+        futures = [executor.submit(translate_batch_item, i, item, db_path, database_info) for i, item in enumerate(items)]
+        for future in as_completed(futures):
+            result = future.result()
+            if 'error' in result:
+                failed += 1
+            else:
+                succeeded += 1
+            yield json.dumps(result, default=str) + '\n'
+        yield json.dumps({"done": True, "succeeded": succeeded, "failed": failed}) + '\n'
+    finally:
+        # Drop queued items if the client goes away mid-batch
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/nl-to-sql/batch', methods=['POST'])
+def nl_to_sql_batch():
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get("items")
+
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "Please provide a non-empty list of items"}), 400
+
+        if len(items) > app.config['BATCH_MAX_ITEMS']:
+            return jsonify({"error": f"A batch may contain at most {app.config['BATCH_MAX_ITEMS']} items"}), 400
+
+        # Introspect once for the whole batch
+        db_path, error = get_request_database()
+        if error:
+            return error
+        database_info = get_database_info(db_path)
+
+        if isinstance(database_info, dict) and 'error' in database_info:
+            return jsonify(database_info), 400
+        if not isinstance(database_info, dict):
+            return jsonify({"error": "Database file not found. Please upload a database first."}), 400
+
+        return Response(
+            stream_batch_results(items, db_path, database_info),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     except Exception as e:
         return jsonify({"error": f"Request processing failed: {str(e)}"}), 500
 
+# Result formats for /execute. 'rows' is a list of objects keyed by column
+# name; 'compact' sends the column names and types once, then rows as arrays;
+# 'columnar' sends one array of values per column.
+RESULT_FORMATS = ('rows', 'compact', 'columnar')
+BLOB_MODES = ('base64', 'omit')
+
+def encode_blobs(rows, blob_mode):
+    """Replace BLOB values, which JSON cannot represent, with base64 text or null"""
+    encoded = []
+    for row in rows:
+        if any(type(value) is bytes for value in row):
+            row = tuple(
+                (base64.b64encode(value).decode('ascii') if blob_mode == 'base64' else None)
+                if type(value) is bytes else value
+                for value in row
+            )
+        encoded.append(row)
+    return encoded
+
+def infer_column_types(rows, column_count):
+    """Storage class of the first non-null value in each column, as Python's sqlite3 does not expose declared types"""
+    types = [None] * column_count
+    missing = column_count
+    for row in rows:
+        for i, value in enumerate(row):
+            if types[i] is None and value is not None:
+                types[i] = {int: 'INTEGER', float: 'REAL', str: 'TEXT', bytes: 'BLOB'}.get(type(value), 'TEXT')
+                missing -= 1
+        if not missing:
+            break
+    return [t or 'NULL' for t in types]
+
+def format_results(columns, rows, result_format, blob_mode):
+    """Shape fetched rows for the JSON response in the requested format"""
+    types = infer_column_types(rows, len(columns)) if result_format != 'rows' else None
+    rows = encode_blobs(rows, blob_mode)
+    if result_format == 'compact':
+        return {'columns': columns, 'types': types, 'rows': rows}
+    if result_format == 'columnar':
+        data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        return {'columns': columns, 'types': types, 'data': data}
+    return {'columns': columns, 'results': [dict(zip(columns, row)) for row in rows]}
+
+# Per-database concurrency scheduler: at most MAX_CONCURRENT_QUERIES run at
+# once, up to MAX_QUEUED_QUERIES wait a bounded time, and the rest are rejected
+query_slots = {}
+query_slots_lock = threading.Lock()
+query_scheduler_stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0, 'cancelled': 0}
+
+# Queries currently executing, keyed by query id so they can be cancelled
+running_queries = {}
+running_queries_lock = threading.Lock()
+
+def acquire_query_slot(db_path):
+    """Take one of the database's query slots, waiting up to QUERY_QUEUE_TIMEOUT for it"""
+    abs_path = os.path.abspath(db_path)
+    with query_slots_lock:
+        slot = query_slots.get(abs_path)
+        if slot is None:
+            slot = {'semaphore': threading.BoundedSemaphore(app.config['MAX_CONCURRENT_QUERIES']), 'waiting': 0, 'running': 0}
+            query_slots[abs_path] = slot
+
+    if slot['semaphore'].acquire(blocking=False):
+        with query_slots_lock:
+            query_scheduler_stats['admitted'] += 1
+            slot['running'] += 1
+        return True
+
+    with query_slots_lock:
+        if slot['waiting'] >= app.config['MAX_QUEUED_QUERIES']:
+            query_scheduler_stats['rejected'] += 1
+            return False
+        slot['waiting'] += 1
+        query_scheduler_stats['queued'] += 1
+
+    acquired = slot['semaphore'].acquire(timeout=app.config['QUERY_QUEUE_TIMEOUT'])
+    with query_slots_lock:
+        slot['waiting'] -= 1
+        query_scheduler_stats['admitted' if acquired else 'rejected'] += 1
+        if acquired:
+            slot['running'] += 1
+    return acquired
+
+def release_query_slot(db_path):
+    with query_slots_lock:
+        slot = query_slots[os.path.abspath(db_path)]
+        slot['running'] -= 1
+    slot['semaphore'].release()
+    record_database_use(db_path)
+
+def keep_database_in_use(db_path, chunks):
+    """Pass a streamed body through, refreshing the database's last-used time as it is sent"""
+    for chunk in chunks:
+        record_database_use(db_path)
+        yield chunk
+
+def start_query_guard(conn, query_id, timeout=None):
+    """Register a running query and enforce its time budget and cancellation via a progress handler"""
+    if timeout is None:
+        timeout = app.config['QUERY_TIMEOUT']
+    guard = {
+        'conn': conn,
+        'timeout': timeout,
+        'deadline': time.monotonic() + timeout,
+        'cancelled': False,
+        'timed_out': False
+    }
+
+    def check_budget():
+        if guard['cancelled']:
+            return 1
+        if time.monotonic() > guard['deadline']:
+            guard['timed_out'] = True
+            return 1
+        return 0
+
+    conn.set_progress_handler(check_budget, 1000)
+    with running_queries_lock:
+        running_queries[query_id] = guard
+    return guard
+
+def finish_query_guard(query_id, guard):
+    with running_queries_lock:
+        if running_queries.get(query_id) is guard:
+            del running_queries[query_id]
+    guard['conn'].set_progress_handler(None, 0)
+
+def guard_error(guard, error):
+    """Replace SQLite's generic 'interrupted' error with the reason the query was stopped"""
+    if guard is not None and guard['timed_out']:
+        with query_slots_lock:
+            query_scheduler_stats['timed_out'] += 1
+        return sqlite3.OperationalError(f"query exceeded the time limit of {guard['timeout']:g} seconds")
+    if guard is not None and guard['cancelled']:
+        with query_slots_lock:
+            query_scheduler_stats['cancelled'] += 1
+        return sqlite3.OperationalError("query was cancelled")
+    return error
+
+def fetch_limited(cursor, max_rows, batch_size):
+    """Read up to max_rows rows in batches, reporting whether more were available"""
+    rows = []
+    while len(rows) <= max_rows:
+        batch = cursor.fetchmany(min(batch_size, max_rows + 1 - len(rows)))
+        if not batch:
+            return rows, False
+        rows.extend(batch)
+    return rows[:max_rows], True
+
+def yield_to_client(guard, chunk):
+    """Yield a chunk of a streamed response; time the client takes to read it does not count against the query"""
+    sent = time.monotonic()
+    yield chunk
+    guard['deadline'] += time.monotonic() - sent
+
+def stream_query_results(cursor, batch_size, max_rows, blob_mode, guard, on_close):
+    """Yield NDJSON lines: the column names, batches of rows, then the row count"""
+    try:
+        columns = [col[0] for col in cursor.description or []]
+        yield from yield_to_client(guard, json.dumps({'columns': columns}) + '\n')
+
+        row_count = 0
+        bytes_sent = 0
+        truncated = False
+        while True:
+            rows = cursor.fetchmany(min(batch_size, max_rows + 1 - row_count))
+            if not rows:
+                break
+            if row_count + len(rows) > max_rows:
+                rows = rows[:max_rows - row_count]
+                truncated = True
+            row_count += len(rows)
+            if rows:
+                line = json.dumps({'rows': encode_blobs(rows, blob_mode)}) + '\n'
+                bytes_sent += len(line)
+                yield from yield_to_client(guard, line)
+            if truncated:
+                break
+
+        yield json.dumps({'row_count': row_count, 'truncated': truncated}) + '\n'
+        inc_metric('nl2sql_rows_returned_total', row_count, mode='stream')
+        inc_metric('nl2sql_response_bytes_total', bytes_sent, route='/execute')
+    except sqlite3.Error as e:
+        yield json.dumps({'error': f'SQL Error: {str(guard_error(guard, e))}'}) + '\n'
+    except Exception as e:
+        yield json.dumps({'error': f'Query execution failed: {str(e)}'}) + '\n'
+    finally:
+        on_close()
+
+# Held cursors for paginated /execute, keyed by an opaque continuation token.
+# Each page continues from where the previous one stopped, so page N costs
+# the same as page 1; cursors idle for longer than the timeout are closed.
+page_cursors = {}
+page_cursors_lock = threading.Lock()
+
+def find_tables_read(conn, query):
+    """Names of the main-database tables a statement reads"""
+    tables_read = set()
+
+    def collect_tables(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and arg1 and db_name == 'main':
+            tables_read.add(arg1)
+        return sqlite3.SQLITE_OK
+
+    # Compiling the statement is enough to run the authorizer for every table read
+    conn.set_authorizer(collect_tables)
+    try:
+        conn.execute(f"EXPLAIN {query}")
+    finally:
+        conn.set_authorizer(None)
+    return tables_read
+
+QUERY_LIMIT_PATTERN = re.compile(r'\bLIMIT\s+(\d+)(?:\s*,\s*(\d+)|\s+OFFSET\s+\d+)?\s*;?\s*$', re.IGNORECASE)
+INDEX_SEARCH_PATTERN = re.compile(r'^SEARCH \S+(?: AS \S+)? USING (?:COVERING )?(INDEX (\S+)|INTEGER PRIMARY KEY|PRIMARY KEY) \((.*)\)$')
+
+def find_query_limit(query):
+    """The literal LIMIT of the outermost query, or None"""
+    match = QUERY_LIMIT_PATTERN.search(query.strip())
+    if match is None:
+        return None
+    # LIMIT offset, count
+    return int(match.group(2) if match.group(2) is not None else match.group(1))
+
+def estimate_search_rows(conn, plan_reads, has_stats):
+    """Rows matched by a single-table plan that looks up an index by equality, from sqlite_stat1, or None"""
+    match = INDEX_SEARCH_PATTERN.match(plan_reads[0]) if len(plan_reads) == 1 else None
+    if match is None:
+        return None
+    terms = match.group(3).split(' AND ')
+    equalities = 0
+    for term in terms:
+        if not re.fullmatch(r'\S+=\?', term):
+            break
+        equalities += 1
+    if not equalities:
+        return None
+    if match.group(2) is None:
+        # Primary key lookups match at most one row once every key column is fixed
+        return 1 if equalities == len(terms) else None
+    if not has_stats:
+        return None
+    row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE idx = ?;", (match.group(2),)).fetchone()
+    counts = row[0].split() if row and row[0] else []
+    if len(counts) <= equalities or not counts[equalities].isdigit():
+        return None
+    return int(counts[equalities])
+
+def estimate_query_rows(conn, query):
+    """Cheap row count estimate, returning (estimate, whether it is only an upper bound)"""
+    # A query that reads one table once returns at most as many rows as that table's rowid span
+    # holds; joins, self-joins, compound selects and subqueries are only approximated by the size
+    # of the largest table they read, and so are sqlite_stat1 counts, which go stale. An equality
+    # lookup on an analyzed index narrows the estimate, and a literal LIMIT is always a bound.
+    tables_read = find_tables_read(conn, query)
+    plan_reads = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+                  if row[3].startswith(('SEARCH', 'SCAN')) and row[3] != 'SCAN CONSTANT ROW']
+    single_read = len(tables_read) == 1 and len(plan_reads) == 1
+
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1';"
+    ).fetchone() is not None
+
+    estimate = None
+    upper_bound = False
+    for table_name in tables_read:
+        table_rows = None
+        if has_stats:
+            row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1;", (table_name,)).fetchone()
+            if row and row[0]:
+                table_rows = int(row[0].split()[0])
+        if table_rows is None:
+            try:
+                table_rows = conn.execute(
+                    f"SELECT max(rowid) - min(rowid) + 1 FROM {quote_identifier(table_name)};"
+                ).fetchone()[0] or 0
+            except sqlite3.Error:
+                continue  # WITHOUT ROWID tables have no cheap estimate
+            upper_bound = single_read
+        estimate = max(estimate or 0, table_rows)
+
+    if single_read:
+        search_rows = estimate_search_rows(conn, plan_reads, has_stats)
+        if search_rows is not None:
+            estimate = min(estimate, search_rows) if estimate is not None else search_rows
+            upper_bound = False
+
+    limit = find_query_limit(query)
+    if limit is not None and (estimate is None or limit < estimate):
+        estimate = limit
+        upper_bound = True
+    return estimate, upper_bound
+
+def close_idle_page_cursors():
+    """Close held cursors that have been idle for longer than the timeout"""
+    cutoff = time.monotonic() - app.config['PAGE_CURSOR_IDLE_TIMEOUT']
+    with page_cursors_lock:
+        expired = [token for token, entry in page_cursors.items() if entry['last_used'] < cutoff]
+        expired_entries = [page_cursors.pop(token) for token in expired]
+    for entry in expired_entries:
+        with entry['lock']:
+            entry['conn'].close()
+
+def open_page_cursor(db_path, query, query_id):
+    """Execute a query and hold its cursor for paginated reads"""
+    close_idle_page_cursors()
+    with page_cursors_lock:
+        if len(page_cursors) >= app.config['MAX_PAGE_CURSORS']:
+            return None
+
+    conn = connect_readonly(db_path, check_same_thread=False)
+    guard = start_query_guard(conn, query_id)
+    try:
+        estimate, upper_bound = estimate_query_rows(conn, query)
+        cursor = conn.cursor()
+        cursor.execute(query)
+    except Exception as e:
+        finish_query_guard(query_id, guard)
+        conn.close()
+        if isinstance(e, sqlite3.Error):
+            raise guard_error(guard, e)
+        raise
+    finish_query_guard(query_id, guard)
+
+    entry = {
+        'conn': conn,
+        'cursor': cursor,
+        'db_path': db_path,
+        'query_id': query_id,
+        'columns': [col[0] for col in cursor.description or []],
+        'rows_read': 0,
+        'pending': [],
+        'estimate': estimate,
+        'upper_bound': upper_bound,
+        'last_used': time.monotonic(),
+        'lock': threading.Lock()
+    }
+    token = secrets.token_urlsafe(24)
+    with page_cursors_lock:
+        page_cursors[token] = entry
+    return token
+
+def read_page(token, page_size):
+    """Fetch the next page from a held cursor, closing it once exhausted"""
+    with page_cursors_lock:
+        entry = page_cursors.get(token)
+    if entry is None:
+        return None
+
+    with entry['lock']:
+        # One row past the page is read ahead to detect the end, and kept for the next page
+        rows = entry['pending']
+        guard = start_query_guard(entry['conn'], entry['query_id'])
+        try:
+            rows += entry['cursor'].fetchmany(page_size + 1 - len(rows))
+        except Exception as e:
+            finish_query_guard(entry['query_id'], guard)
+            with page_cursors_lock:
+                page_cursors.pop(token, None)
+            entry['conn'].close()
+            if isinstance(e, sqlite3.Error):
+                raise guard_error(guard, e)
+            raise
+        finish_query_guard(entry['query_id'], guard)
+        has_more = len(rows) > page_size
+        entry['pending'] = rows[page_size:]
+        rows = rows[:page_size]
+        entry['rows_read'] += len(rows)
+        entry['last_used'] = time.monotonic()
+        columns = entry['columns']
+        rows_read = entry['rows_read']
+        estimate = entry['estimate']
+        upper_bound = entry['upper_bound']
+
+    if not has_more:
+        with page_cursors_lock:
+            page_cursors.pop(token, None)
+        entry['conn'].close()
+        estimate = rows_read
+        upper_bound = False
+    elif estimate is not None and estimate < rows_read + 1:
+        estimate = rows_read + 1  # more rows follow, so the estimate was too low
+
+    return {
+        'columns': columns,
+        'rows': rows,
+        'next_token': token if has_more else None,
+        'rows_read': rows_read,
+        'row_count_estimate': estimate,
+        'row_count_upper_bound': upper_bound,
+        'row_count_exact': not has_more
+    }
+
 @app.route('/execute', methods=['POST'])
 def execute_query():
     try:
         data = request.get_json()
+
+        page_size = data.get('page_size')
+        if page_size is not None:
+            try:
+                page_size = int(page_size)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'page_size must be an integer'}), 400
+            if not 1 <= page_size <= app.config['MAX_PAGE_SIZE']:
+                return jsonify({'error': f"page_size must be between 1 and {app.config['MAX_PAGE_SIZE']}"}), 400
+
+        result_format = data.get('format', 'rows')
+        if result_format not in RESULT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(RESULT_FORMATS)}"}), 400
+        blob_mode = data.get('blobs', 'base64')
+        if blob_mode not in BLOB_MODES:
+            return jsonify({'error': f"blobs must be one of: {', '.join(BLOB_MODES)}"}), 400
+
+        # Continue a paginated query from its held cursor
+        token = data.get('continuation_token')
+        if token:
+            close_idle_page_cursors()
+            with page_cursors_lock:
+                entry = page_cursors.get(token)
+            if entry is None:
+                return jsonify({'error': 'Unknown or expired continuation token. Please run the query again.'}), 404
+            if not acquire_query_slot(entry['db_path']):
+                return jsonify({'error': 'Too many queries are running on this database. Please try again shortly.'}), 429
+            try:
+                with timed_stage('sql'):
+                    page = read_page(token, page_size or 100)
+            finally:
+                release_query_slot(entry['db_path'])
+            if page is None:
+                return jsonify({'error': 'Unknown or expired continuation token. Please run the query again.'}), 404
+            inc_metric('nl2sql_rows_returned_total', len(page['rows']), mode='page')
+            with timed_stage('convert'):
+                page.update(format_results(page['columns'], page.pop('rows'), result_format, blob_mode))
+            with timed_stage('serialize'):
+                return jsonify(page)
+
         query = data.get('query', '').strip()
         
         if not query:
             return jsonify({'error': 'No SQL query provided'}), 400
         
-        db_path = os.path.join(app.config['UPLOAD_FOLDER'], 'database.db')
+        db_path, error = get_request_database()
+        if error:
+            return error
         if not os.path.exists(db_path):
             return jsonify({'error': 'Database file not found. Please upload a database first.'}), 400
         
-        # Basic SQL injection prevention - block dangerous keywords
-        dangerous_keywords = ['drop', 'delete', 'update', 'insert', 'alter', 'create', 'truncate']
-        query_lower = query.lower()
-        
-        # Allow only SELECT statements for safety
-        if not query_lower.strip().startswith('select'):
-            return jsonify({'error': 'Only SELECT queries are allowed for security reasons.'}), 400
+        # Allow only a single read-only statement; it is compiled, not run, under a read-only authorizer
+        error = read_only_query_error(db_path, query)
+        if error:
+            return jsonify({'error': error}), 400
         
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # This enables column access by name
-        cursor = conn.cursor()
-        
-        cursor.execute(query)
-        results = cursor.fetchall()
+        query_id = str(data.get('query_id') or secrets.token_hex(8))[:64]
+        with running_queries_lock:
+            if query_id in running_queries:
+                return jsonify({'error': f'A query with id {query_id} is already running.'}), 409
+
+        if not acquire_query_slot(db_path):
+            return jsonify({'error': 'Too many queries are running on this database. Please try again shortly.'}), 429
+
+        if page_size is not None:
+            try:
+                token = open_page_cursor(db_path, query, query_id)
+                if token is None:
+                    return jsonify({'error': 'Too many open paginated queries. Please try again later.'}), 503
+                with timed_stage('sql'):
+                    page = read_page(token, page_size)
+            finally:
+                release_query_slot(db_path)
+            inc_metric('nl2sql_rows_returned_total', len(page['rows']), mode='page')
+            with timed_stage('convert'):
+                page.update(format_results(page['columns'], page.pop('rows'), result_format, blob_mode), query_id=query_id)
+            with timed_stage('serialize'):
+                return jsonify(page)
+
+        if data.get('stream'):
+            conn = guard = None
+            stream_closed = []
+
+            def close_stream():
+                if stream_closed:
+                    return
+                stream_closed.append(True)
+                if guard is not None:
+                    finish_query_guard(query_id, guard)
+                if conn is not None:
+                    conn.close()
+                release_query_slot(db_path)
+
+            try:
+                conn = connect_readonly(db_path)
+                guard = start_query_guard(conn, query_id)
+                cursor = conn.cursor()
+                cursor.execute(query)
+            except sqlite3.Error as e:
+                close_stream()
+                raise guard_error(guard, e)
+            except Exception:
+                close_stream()
+                raise
+            response = Response(
+                keep_database_in_use(db_path, stream_query_results(cursor, app.config['STREAM_BATCH_SIZE'], app.config['QUERY_MAX_ROWS'],
+                                                                   blob_mode, guard, close_stream)),
+                mimetype='application/x-ndjson',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Query-Id': query_id}
+            )
+            # Also runs if the client disconnects before the generator starts
+            response.call_on_close(close_stream)
+            return response
+
+        cursor = guard = None
+        try:
+            conn = get_pooled_connection(db_path)
+            cursor = conn.cursor()
+            guard = start_query_guard(conn, query_id)
+            with timed_stage('sql'):
+                cursor.execute(query)
+                columns = [col[0] for col in cursor.description or []]
+                results, truncated = fetch_limited(cursor, app.config['QUERY_MAX_ROWS'], app.config['STREAM_BATCH_SIZE'])
+        except sqlite3.Error as e:
+            raise guard_error(guard, e)
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if guard is not None:
+                finish_query_guard(query_id, guard)
+            release_query_slot(db_path)
         
-        # Convert to list of dictionaries
-        results_list = [dict(row) for row in results]
+        with timed_stage('convert'):
+            payload = format_results(columns, results, result_format, blob_mode)
+        inc_metric('nl2sql_rows_returned_total', len(results), mode='json')
         
-        conn.close()
-        return jsonify({'results': results_list})
+        with timed_stage('serialize'):
+            return jsonify(dict(payload, truncated=truncated, query_id=query_id))
         
     except sqlite3.Error as e:
         return jsonify({'error': f'SQL Error: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'Query execution failed: {str(e)}'}), 500
 
+EXPORT_FORMATS = {'csv': ('text/csv', 'csv'), 'jsonl': ('application/x-ndjson', 'jsonl')}
+
+def export_rows(cursor, export_format, batch_size, guard, on_close):
+    """Yield the result as CSV or JSON Lines text, one chunk per fetchmany batch"""
+    columns = [col[0] for col in cursor.description or []]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(columns)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            rows = encode_blobs(rows, 'base64')
+            if export_format == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(columns, row))) + '\n')
+            yield from yield_to_client(guard, buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+    except sqlite3.Error as e:
+        # The status line has already been sent, so the failure is recorded in the file itself
+        message = f'SQL Error: {str(guard_error(guard, e))}'
+        if export_format == 'csv':
+            writer.writerow([f'ERROR: {message}'])
+            yield buffer.getvalue()
+        else:
+            yield json.dumps({'error': message}) + '\n'
+    finally:
+        on_close()
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks into a single gzip member as they are produced"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@app.route('/export', methods=['POST'])
+def export_query():
+    try:
+        # Accept a regular form post so the browser handles the download
+        data = request.get_json(silent=True) or request.form
+        query = data.get('query', '').strip()
+        export_format = data.get('format', 'csv')
+        compress = str(data.get('gzip', '')).lower() in ('1', 'true', 'on', 'yes')
+
+        if not query:
+            return jsonify({'error': 'No SQL query provided'}), 400
+
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+        db_path, error = get_request_database()
+        if error:
+            return error
+        if not os.path.exists(db_path):
+            return jsonify({'error': 'Database file not found. Please upload a database first.'}), 400
+
+        # Allow only a single read-only statement; it is compiled, not run, under a read-only authorizer
+        error = read_only_query_error(db_path, query)
+        if error:
+            return jsonify({'error': error}), 400
+
+        query_id = str(data.get('query_id') or secrets.token_hex(8))[:64]
+        with running_queries_lock:
+            if query_id in running_queries:
+                return jsonify({'error': f'A query with id {query_id} is already running.'}), 409
+
+        if not acquire_query_slot(db_path):
+            return jsonify({'error': 'Too many queries are running on this database. Please try again shortly.'}), 429
+
+        conn = guard = None
+        export_closed = []
+
+        def close_export():
+            if export_closed:
+                return
+            export_closed.append(True)
+            if guard is not None:
+                finish_query_guard(query_id, guard)
+            if conn is not None:
+                conn.close()
+            release_query_slot(db_path)
+
+        try:
+            conn = connect_readonly(db_path)
+            guard = start_query_guard(conn, query_id, app.config['EXPORT_TIMEOUT'])
+            cursor = conn.cursor()
+            cursor.execute(query)
+        except sqlite3.Error as e:
+            close_export()
+            raise guard_error(guard, e)
+        except Exception:
+            close_export()
+            raise
+
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        body = keep_database_in_use(db_path, export_rows(cursor, export_format, app.config['EXPORT_BATCH_SIZE'], guard, close_export))
+        filename = f'query_results.{extension}'
+        if compress:
+            body = gzip_chunks(body)
+            mimetype = 'application/gzip'
+            filename += '.gz'
+
+        response = Response(body, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'X-Query-Id': query_id
+        })
+        response.call_on_close(close_export)
+        return response
+
+    except sqlite3.Error as e:
+        return jsonify({'error': f'SQL Error: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Export failed: {str(e)}'}), 500
+
+# Query plan analysis and index advisor. The plan comes from EXPLAIN QUERY
+# PLAN; index suggestions come from the plan's full scans, automatic indexes
+# and temp B-trees combined with the filter, join and sort columns the query uses.
+SQL_CLAUSE_KEYWORDS = {
+    'where', 'join', 'inner', 'left', 'right', 'full', 'cross', 'natural', 'outer', 'on', 'using',
+    'group', 'order', 'limit', 'union', 'except', 'intersect', 'window', 'having'
+}
+MAX_INDEX_COLUMNS = 6
+
+def unquote_identifier(name):
+    if len(name) >= 2 and (name[0], name[-1]) in (('"', '"'), ('`', '`'), ('[', ']')):
+        return name[1:-1].replace('""', '"')
+    return name
+
+def summarize_query_plan(conn, query):
+    """Run EXPLAIN QUERY PLAN and classify each step"""
+    steps = []
+    summary = {'steps': steps, 'full_scans': [], 'index_scans': [], 'index_searches': [], 'automatic_indexes': [], 'temp_btrees': []}
+    # Sources are matched against the names and aliases the query uses, since table names may
+    # contain spaces; SQLite before 3.36 also writes "SCAN TABLE name AS alias"
+    sources = map_query_sources(query, {name: [] for name in find_tables_read(conn, query)})
+    names = '|'.join(re.escape(name) for name in sorted(sources, key=len, reverse=True))
+    access = r'(?: USING (AUTOMATIC )?(?:COVERING )?(INDEX|INTEGER PRIMARY KEY|PRIMARY KEY)\b(?: ([^\s(]\S*))?(?: \((.*)\))?)?'
+    patterns = [re.compile(rf'(SCAN|SEARCH) (?:TABLE )?(\S+){access}')]
+    if names:
+        patterns[:0] = [re.compile(rf'(SCAN|SEARCH) (?:TABLE )?(?:{names}) AS (\S+){access}', re.IGNORECASE),
+                        re.compile(rf'(SCAN|SEARCH) (?:TABLE )?({names})(?= USING |$){access}', re.IGNORECASE)]
+    for plan_id, parent, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall():
+        kind = 'other'
+        match = next((m for m in (pattern.match(detail) for pattern in patterns) if m), None)
+        if detail.startswith('USE TEMP B-TREE FOR '):
+            kind = 'temp_btree'
+            summary['temp_btrees'].append(detail[len('USE TEMP B-TREE FOR '):])
+        elif match and match.group(2) not in ('CONSTANT', 'SUBQUERY') and not match.group(2).startswith('('):
+            source = match.group(2)
+            if match.group(3):
+                kind = 'automatic_index'
+                summary['automatic_indexes'].append({'source': source, 'constraints': match.group(6) or ''})
+            elif match.group(1) == 'SEARCH':
+                kind = 'index_search'
+                summary['index_searches'].append(source)
+            elif match.group(4):
+                kind = 'index_scan'
+                summary['index_scans'].append(source)
+            else:
+                kind = 'full_scan'
+                summary['full_scans'].append(source)
+        steps.append({'id': plan_id, 'parent': parent, 'detail': detail, 'kind': kind})
+    return summary
+
+def map_query_sources(query, table_columns):
+    """Map table names and aliases used in FROM/JOIN clauses to table names"""
+    sources = {name.lower(): name for name in table_columns}
+    pattern = re.compile(r'\b(?:from|join)\s+("(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|\w+)(?:\s+(?:as\s+)?(\w+))?', re.IGNORECASE)
+    for match in pattern.finditer(query):
+        table_name = sources.get(unquote_identifier(match.group(1)).lower())
+        alias = match.group(2)
+        if table_name and alias and alias.lower() not in SQL_CLAUSE_KEYWORDS:
+            sources[alias.lower()] = table_name
+    return sources
+
+def find_column_references(query, table_columns, sources):
+    """Classify column references by use: equality and range filters, and ORDER BY/GROUP BY keys"""
+    references = {'equality': [], 'range': [], 'sort': []}
+    identifier = r'(?:(\w+|"[^"]+")\.)?(\w+|"[^"]+")'
+
+    def resolve(qualifier, column):
+        column = unquote_identifier(column)
+        if qualifier:
+            table_name = sources.get(unquote_identifier(qualifier).lower())
+            candidates = [table_name] if table_name else []
+        else:
+            candidates = [t for t in set(sources.values())]
+        return [(t, c) for t in candidates for c in table_columns.get(t, []) if c.lower() == column.lower()]
+
+    comparison = r'(=|==|<>|!=|<=|>=|<|>|\bLIKE\b|\bGLOB\b|\bIN\b|\bBETWEEN\b|\bIS\b)'
+    for match in re.finditer(identifier + r'\s*' + comparison, query, re.IGNORECASE):
+        use = 'equality' if match.group(3).upper() in ('=', '==', 'IN', 'IS') else 'range'
+        references[use].extend(resolve(match.group(1), match.group(2)))
+    for match in re.finditer(r'(?:=|==)\s*' + identifier, query):
+        references['equality'].extend(resolve(match.group(1), match.group(2)))
+    for clause in re.finditer(r'\b(?:order|group)\s+by\s+(.+?)(?=\blimit\b|\bhaving\b|\border\s+by\b|\)|;|$)', query, re.IGNORECASE | re.DOTALL):
+        for term in clause.group(1).split(','):
+            match = re.match(r'\s*' + identifier, term)
+            if match:
+                references['sort'].extend(resolve(match.group(1), match.group(2)))
+    return references
+
+def index_exists(conn, table_name, columns):
+    """Whether an existing index already starts with the given columns"""
+    for index in conn.execute(f"PRAGMA index_list({quote_identifier(table_name)});").fetchall():
+        indexed = [row[2] for row in conn.execute(f"PRAGMA index_info({quote_identifier(index[1])});").fetchall()]
+        if [c.lower() for c in indexed[:len(columns)]] == [c.lower() for c in columns]:
+            return True
+    return False
+
+def find_rowid_alias(conn, table_name):
+    """The INTEGER PRIMARY KEY column that aliases a table's rowid, or None"""
+    pk_columns = [(name, column_type) for _, name, column_type, _, _, pk in
+                  conn.execute("SELECT * FROM pragma_table_info(?);", (table_name,)).fetchall() if pk]
+    if len(pk_columns) != 1 or pk_columns[0][1].upper() != 'INTEGER':
+        return None
+    # WITHOUT ROWID tables list their primary key as an index
+    if any(origin == 'pk' for _, _, _, origin, _ in conn.execute("SELECT * FROM pragma_index_list(?);", (table_name,)).fetchall()):
+        return None
+    return pk_columns[0][0]
+
+def suggest_indexes(conn, query, plan, database_info):
+    """Suggest covering indexes for tables the plan scans in full or indexes automatically"""
+    table_columns = {name: [col['name'] for col in info['columns']] for name, info in database_info['data'].items()}
+    sources = map_query_sources(query, table_columns)
+    references = find_column_references(query, table_columns, sources)
+
+    # Columns the query reads per table, from the authorizer, for covering indexes
+    columns_read = {}
+
+    def collect_columns(action, table_name, column, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and table_name and column:
+            columns_read.setdefault(table_name, [])
+            if column not in columns_read[table_name]:
+                columns_read[table_name].append(column)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(collect_columns)
+    try:
+        conn.execute(f"EXPLAIN {query}")
+    finally:
+        conn.set_authorizer(None)
+
+    targets = {}
+    for source in plan['full_scans']:
+        table_name = sources.get(source.lower())
+        if table_name:
+            targets.setdefault(table_name, 'full table scan')
+    for automatic in plan['automatic_indexes']:
+        table_name = sources.get(automatic['source'].lower())
+        if table_name:
+            targets[table_name] = 'automatic index built on every run'
+
+    suggestions = []
+    for table_name, reason in targets.items():
+        def columns_for(use):
+            return [c for t, c in references[use] if t == table_name]
+
+        key_columns = []
+        for column in columns_for('equality') + columns_for('range')[:1]:
+            if column not in key_columns:
+                key_columns.append(column)
+        if plan['temp_btrees'] and len(targets) == 1:
+            for column in columns_for('sort'):
+                if column not in key_columns:
+                    key_columns.append(column)
+        if not key_columns:
+            continue
+        key_columns = key_columns[:MAX_INDEX_COLUMNS]
+
+        # Add the remaining columns the query reads so the index alone can answer it; every
+        # index already stores the rowid, so an INTEGER PRIMARY KEY column is never added
+        index_columns = list(key_columns)
+        rowid_alias = find_rowid_alias(conn, table_name)
+        extra = [c for c in columns_read.get(table_name, [])
+                 if c not in index_columns and c in table_columns[table_name] and c != rowid_alias]
+        covering = len(index_columns) + len(extra) <= MAX_INDEX_COLUMNS
+        if covering:
+            index_columns += extra
+
+        if index_exists(conn, table_name, key_columns):
+            continue
+
+        index_name = re.sub(r'\W+', '_', f"idx_{table_name}_{'_'.join(index_columns)}")[:60]
+        suggestions.append({
+            'table': table_name,
+            'columns': index_columns,
+            'covering': covering,
+            'reason': reason,
+            'sql': f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} ON {quote_identifier(table_name)} "
+                   f"({', '.join(quote_identifier(c) for c in index_columns)});"
+        })
+    return suggestions
+
+def time_query(conn, query, query_id, runs=3):
+    """Best wall time in milliseconds over a few full executions of a query"""
+    best = None
+    for _ in range(runs):
+        guard = start_query_guard(conn, query_id)
+        try:
+            start = time.perf_counter()
+            cursor = conn.execute(query)
+            while cursor.fetchmany(app.config['STREAM_BATCH_SIZE']):
+                pass
+            elapsed = (time.perf_counter() - start) * 1000
+        except sqlite3.Error as e:
+            raise guard_error(guard, e)
+        finally:
+            finish_query_guard(query_id, guard)
+        best = elapsed if best is None else min(best, elapsed)
+        if elapsed > 1000:
+            break
+    return round(best, 3)
+
+def estimate_tables_bytes(conn, db_path, tables):
+    """Bytes used by some tables and their indexes, or the whole file when dbstat is unavailable"""
+    placeholders = ', '.join('?' * len(tables))
+    try:
+        return conn.execute(
+            f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+            f"(SELECT name FROM sqlite_master WHERE tbl_name IN ({placeholders}));", tuple(tables)
+        ).fetchone()[0]
+    except sqlite3.Error:
+        return os.path.getsize(db_path)
+
+def copy_tables(db_path, work, tables):
+    """Copy some tables with their indexes, and all views, from a database into an empty one"""
+    work.execute("ATTACH DATABASE ? AS source;", (f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro",))
+    placeholders = ', '.join('?' * len(tables))
+    objects = work.execute(
+        f"SELECT type, name, sql FROM source.sqlite_master WHERE sql IS NOT NULL "
+        f"AND ((type IN ('table', 'index') AND tbl_name IN ({placeholders})) OR type = 'view') "
+        f"ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END;", tuple(tables)
+    ).fetchall()
+    for object_type, name, sql in objects:
+        if object_type == 'table':
+            if sql.upper().startswith('CREATE VIRTUAL'):
+                raise sqlite3.OperationalError(f"virtual table '{name}' cannot be copied")
+            work.execute(sql)
+            work.execute(f"INSERT INTO main.{quote_identifier(name)} SELECT * FROM source.{quote_identifier(name)};")
+        elif object_type == 'index':
+            work.execute(sql)
+        else:
+            try:
+                work.execute(sql)
+            except sqlite3.Error:
+                pass  # a view over tables that were not copied; the query does not use it
+    work.commit()
+    work.execute("DETACH DATABASE source;")
+
+def benchmark_indexes(db_path, query, suggestions, query_id):
+    """Build suggested indexes on a copy of the tables a query reads and time the query before and after"""
+    source = connect_readonly(db_path)
+    try:
+        tables = find_tables_read(source, query) | {suggestion['table'] for suggestion in suggestions}
+        copy_bytes = estimate_tables_bytes(source, db_path, tables)
+        if copy_bytes > app.config['INDEX_BENCHMARK_MAX_BYTES']:
+            return {'skipped': f"the tables this query reads hold {copy_bytes} bytes, more than the "
+                               f"{app.config['INDEX_BENCHMARK_MAX_BYTES']} bytes allowed for a working copy"}
+    finally:
+        source.close()
+
+    work_dir = tempfile.mkdtemp(prefix='index-advisor-', dir=app.config['UPLOAD_FOLDER'])
+    work_path = os.path.join(work_dir, 'working_copy.db')
+    try:
+        work = sqlite3.connect(work_path, uri=True)
+        try:
+            # Both timings run on the working copy with fresh statistics, so the difference
+            # comes from the indexes alone and not from the file layout or ANALYZE
+            def prepare(statements):
+                # Copying and indexing count against the same time budget and cancellation as queries
+                guard = start_query_guard(work, query_id)
+                try:
+                    statements()
+                    work.execute("ANALYZE;")
+                    work.commit()
+                except sqlite3.Error as e:
+                    raise guard_error(guard, e)
+                finally:
+                    finish_query_guard(query_id, guard)
+
+            prepare(lambda: copy_tables(db_path, work, tables))
+            before_ms = time_query(work, query, query_id)
+            prepare(lambda: [work.execute(suggestion['sql']) for suggestion in suggestions])
+            after_ms = time_query(work, query, query_id)
+            plan_after = summarize_query_plan(work, query)
+        finally:
+            work.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'before_ms': before_ms,
+        'after_ms': after_ms,
+        'speedup': round(before_ms / after_ms, 2) if after_ms else None,
+        'plan_after': plan_after,
+        'copied_tables': sorted(tables),
+        'copy_bytes': copy_bytes
+    }
+
+@app.route('/explain', methods=['POST'])
+def explain_query():
+    try:
+        data = request.get_json(silent=True) or {}
+        query = data.get('query', '').strip()
+
+        if not query:
+            return jsonify({'error': 'No SQL query provided'}), 400
+
+        db_path, error = get_request_database()
+        if error:
+            return error
+        if not os.path.exists(db_path):
+            return jsonify({'error': 'Database file not found. Please upload a database first.'}), 400
+
+        # Allow only a single read-only statement; it is compiled, not run, under a read-only authorizer
+        error = read_only_query_error(db_path, query)
+        if error:
+            return jsonify({'error': error}), 400
+
+        database_info = get_database_info(db_path)
+        if isinstance(database_info, dict) and 'error' in database_info:
+            return jsonify(database_info), 400
+
+        conn = get_pooled_connection(db_path)
+        plan = summarize_query_plan(conn, query)
+        suggestions = suggest_indexes(conn, query, plan, database_info)
+        result = {'plan': plan, 'suggestions': suggestions}
+
+        # Optionally measure the suggestions on a working copy; the uploaded database is never modified
+        if data.get('build_indexes') and suggestions:
+            query_id = str(data.get('query_id') or secrets.token_hex(8))[:64]
+            if not acquire_query_slot(db_path):
+                return jsonify({'error': 'Too many queries are running on this database. Please try again shortly.'}), 429
+            try:
+                result['benchmark'] = benchmark_indexes(db_path, query, suggestions, query_id)
+            finally:
+                release_query_slot(db_path)
+
+        return jsonify(result)
+
+    except sqlite3.Error as e:
+        return jsonify({'error': f'SQL Error: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Query analysis failed: {str(e)}'}), 500
+
+@app.route('/cancel/<query_id>', methods=['POST'])
+def cancel_query(query_id):
+    # Interrupt while the guard is still registered: once a query finishes, its pooled
+    # connection may already be running the next request's query
+    with running_queries_lock:
+        guard = running_queries.get(query_id)
+        if guard is not None:
+            guard['cancelled'] = True
+            guard['conn'].interrupt()
+    if guard is None:
+        return jsonify({'error': f'No running query with id {query_id}.'}), 404
+    return jsonify({'message': 'Query cancellation requested.'})
+
 if __name__ == '__main__':
     print("=== NL to SQL Converter ===")
     print("Make sure your .env file contains GEMINI_API_KEY=your_actual_api_key")
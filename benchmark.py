@@ -0,0 +1,295 @@
+"""Offline load benchmark for the NL to SQL Converter.
+
+Generates SQLite databases of increasing size, uploads each one and drives
+/upload, /get-tables, /nl-to-sql and /execute through the Flask test client
+with the local fake LLM backend, then reports throughput and p50/p95/p99
+latency per route. /nl-to-sql runs both for a single table and in multi-table
+mode, and /execute once per result format to compare bytes on the wire and
+serialization time. A startup pass first imports the app in fresh interpreters
+and times the import, the first requests a new worker serves and the wait for
+its LLM client, for the fake backend and, when google-generativeai is
+installed, for the Gemini backend with a stub key (no request reaches Gemini).
+
+    python benchmark.py
+    python benchmark.py --sizes 5x1000x5,20x10000x10 --requests 200 --concurrency 8
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+# The benchmark never talks to Gemini
+os.environ.setdefault('LLM_BACKEND', 'fake')
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet']
+
+def parse_sizes(value):
+    """Parse 'TABLESxROWSxCOLUMNS,...' into a list of tuples"""
+    sizes = []
+    for part in value.split(','):
+        tables, rows, columns = (int(n) for n in part.lower().split('x'))
+        sizes.append((tables, rows, columns))
+    return sizes
+
+def generate_database(path, tables, rows, columns, seed=0):
+    """Create a database with the given number of tables, rows per table and columns per table"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    for t in range(tables):
+        column_defs = ['id INTEGER PRIMARY KEY']
+        for c in range(columns - 1):
+            column_defs.append(f"c{c} {'TEXT' if c % 2 else 'INTEGER'}")
+        conn.execute(f"CREATE TABLE t{t} ({', '.join(column_defs)})")
+
+        placeholders = ', '.join('?' * columns)
+        batch = []
+        for r in range(rows):
+            row = [r]
+            for c in range(columns - 1):
+                row.append(rng.choice(WORDS) if c % 2 else rng.randint(0, 10000))
+            batch.append(row)
+            if len(batch) >= 10000:
+                conn.executemany(f"INSERT INTO t{t} VALUES ({placeholders})", batch)
+                batch = []
+        if batch:
+            conn.executemany(f"INSERT INTO t{t} VALUES ({placeholders})", batch)
+    conn.commit()
+    conn.close()
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_load(app, route, make_request, total, concurrency):
+    """Issue total requests from concurrency threads and collect latencies in milliseconds"""
+    latencies = []
+    errors = []
+    sizes = []
+    serialize_times = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            response = make_request(client, i)
+            body = response.get_data()
+            elapsed = (time.perf_counter() - start) * 1000
+            serialize = re.search(r'serialize;dur=([\d.]+)', response.headers.get('Server-Timing', ''))
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(len(body))
+                if serialize:
+                    serialize_times.append(float(serialize.group(1)))
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    serialize_times.sort()
+    return {
+        'route': route,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': round(len(latencies) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'avg_bytes': round(sum(sizes) / len(sizes)) if sizes else 0,
+        'serialize_p50_ms': round(percentile(serialize_times, 50), 2)
+    }
+
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app as app_module
+imported = time.perf_counter()
+app = app_module.app
+app.config['UPLOAD_FOLDER'] = sys.argv[2]
+app.config['TRANSLATION_CACHE_PATH'] = sys.argv[2] + '/translation_cache.db'
+client = app.test_client()
+timings = {'import_ms': (imported - started) * 1000}
+for name, request in [('first_page_ms', lambda: client.get('/', headers={'Accept-Encoding': 'gzip'})),
+                      ('second_page_ms', lambda: client.get('/', headers={'Accept-Encoding': 'gzip'}))]:
+    start = time.perf_counter()
+    response = request()
+    response.get_data()
+    timings[name] = (time.perf_counter() - start) * 1000
+
+# Time until the LLM client is usable: its construction, or what is left of the warm-up
+start = time.perf_counter()
+app_module.get_llm_backend()
+timings['llm_client_ms'] = (time.perf_counter() - start) * 1000
+timings['llm_construct_ms'] = app_module.llm_startup['ready_ms']
+
+# A real first translation would call Gemini, so it is only timed for the fake backend
+timings['first_nl_to_sql_ms'] = None
+if app_module.LLM_BACKEND_NAME == 'fake':
+    start = time.perf_counter()
+    client.post('/nl-to-sql', json={'query': 'show all rows', 'table': 't0'}).get_data()
+    timings['first_nl_to_sql_ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(timings))
+"""
+
+def benchmark_startup(workdir, args):
+    """Time the import and first requests of a fresh worker, with and without the LLM warm-up thread"""
+    folder = os.path.join(workdir, 'startup')
+    os.makedirs(folder, exist_ok=True)
+    generate_database(os.path.join(folder, 'database.db'), 1, 100, 4)
+
+    backends = ['fake']
+    if importlib.util.find_spec('google') is not None and importlib.util.find_spec('google.generativeai') is not None:
+        backends.append('gemini')
+    else:
+        print("google-generativeai is not installed; skipping the Gemini startup measurement\n")
+
+    results = []
+    for backend, warmup in [(backend, warmup) for backend in backends for warmup in ('0', '1')]:
+        env = dict(os.environ, LLM_BACKEND=backend, LLM_WARMUP=warmup)
+        if backend == 'gemini':
+            env.setdefault('GEMINI_API_KEY', 'benchmark-stub-key')
+        runs = []
+        for _ in range(args.startup_runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, os.path.dirname(os.path.abspath(__file__)), folder],
+                                    env=env, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        result = {'backend': backend, 'warmup': warmup == '1', 'runs': len(runs)}
+        for key in runs[0]:
+            values = sorted(run[key] for run in runs if run[key] is not None)
+            result[key] = round(values[len(values) // 2], 2) if values else None
+        results.append(result)
+    return results
+
+def print_startup(results):
+    header = (f"{'backend':>8} {'warm-up':>8} {'runs':>5} {'import ms':>10} {'1st page ms':>12} {'2nd page ms':>12} "
+              f"{'client wait ms':>15} {'client build ms':>16} {'1st nl2sql ms':>14}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['backend']:>8} {str(r['warmup']):>8} {r['runs']:>5} {r['import_ms']:>10} {r['first_page_ms']:>12} "
+              f"{r['second_page_ms']:>12} {r['llm_client_ms']:>15} {str(r['llm_construct_ms']):>16} "
+              f"{str(r['first_nl_to_sql_ms']):>14}")
+    print()
+
+def benchmark_size(app, workdir, size, args):
+    tables, rows, columns = size
+    source = os.path.join(workdir, f"bench_{tables}x{rows}x{columns}.db")
+    generate_database(source, tables, rows, columns)
+    with open(source, 'rb') as f:
+        payload = f.read()
+
+    def upload(client, i):
+        return client.post('/upload', data={'file': (BytesIO(payload), 'bench.db')})
+
+    def get_tables(client, i):
+        return client.get('/get-tables')
+
+    def nl_to_sql(client, i):
+        # A quarter of the questions repeat so translation cache hits are exercised too
+        question = f"show rows where c0 is above {i % max(1, args.requests // 4)}"
+        return client.post('/nl-to-sql', json={'query': question, 'table': f"t{i % tables}"})
+
+    def nl_to_sql_all_tables(client, i):
+        # Multi-table mode: the prompt should stay the same size as the schema grows
+        question = f"show t{i % tables} rows where c0 is above {i % max(1, args.requests // 4)}"
+        return client.post('/nl-to-sql', json={'query': question, 'table': '*'})
+
+    def execute(client, i):
+        return client.post('/execute', json={'query': f"SELECT * FROM t{i % tables} WHERE c0 > {i % 10000} LIMIT 100"})
+
+    def execute_format(result_format):
+        query = f"SELECT * FROM t0 LIMIT {args.result_rows}"
+        return lambda client, i: client.post('/execute', json={'query': query, 'format': result_format})
+
+    results = [run_load(app, '/upload', upload, args.uploads, 1)]
+    results.append(run_load(app, '/get-tables', get_tables, args.requests, args.concurrency))
+    results.append(run_load(app, '/nl-to-sql', nl_to_sql, args.requests, args.concurrency))
+    results.append(run_load(app, '/nl-to-sql *', nl_to_sql_all_tables, args.requests, args.concurrency))
+    results.append(run_load(app, '/execute', execute, args.requests, args.concurrency))
+    for result_format in ('rows', 'compact', 'columnar'):
+        results.append(run_load(app, f"/execute {result_format}", execute_format(result_format), args.requests, args.concurrency))
+
+    for result in results:
+        result['size'] = f"{tables}x{rows}x{columns}"
+        result['db_bytes'] = len(payload)
+    return results
+
+def print_table(results):
+    header = (f"{'size':>16} {'route':<18} {'reqs':>6} {'errs':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'avg bytes':>10} {'ser. ms':>8}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['size']:>16} {r['route']:<18} {r['requests']:>6} {r['errors']:>5} {r['throughput']:>9} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['avg_bytes']:>10} {r['serialize_p50_ms']:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('2x100x4,10x5000x8,25x20000x16'),
+                        help="comma separated TABLESxROWSxCOLUMNS (default: 2x100x4,10x5000x8,25x20000x16)")
+    parser.add_argument('--requests', type=int, default=100, help="requests per route and size")
+    parser.add_argument('--uploads', type=int, default=3, help="uploads per size")
+    parser.add_argument('--result-rows', type=int, default=2000, help="rows per query in the result format comparison")
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent client threads")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="fake LLM latency in seconds")
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0, help="fake LLM failure probability")
+    parser.add_argument('--startup-runs', type=int, default=3, help="fresh interpreters per startup measurement (0 to skip)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    os.environ['FAKE_LLM_LATENCY'] = str(args.llm_latency)
+    os.environ['FAKE_LLM_FAILURE_RATE'] = str(args.llm_failure_rate)
+
+    # Generated databases, stored copies and the translation cache are removed afterwards
+    workdir = tempfile.mkdtemp(prefix='nl2sql-bench-')
+    try:
+        startup = benchmark_startup(workdir, args) if args.startup_runs > 0 else []
+
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import app as app_module
+
+        app = app_module.app
+        app.config['UPLOAD_FOLDER'] = workdir
+        app.config['MAX_CONTENT_LENGTH'] = None
+        app.config['TRANSLATION_CACHE_PATH'] = os.path.join(workdir, 'translation_cache.db')
+
+        results = []
+        for size in args.sizes:
+            results.extend(benchmark_size(app, workdir, size, args))
+    
+        if args.json:
+            print(json.dumps({'startup': startup, 'routes': results}, indent=2))
+        else:
+            if startup:
+                print_startup(startup)
+            print_table(results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+import sqlite3
+import sys
+from io import BytesIO
+
+import pytest
+
+# Tests never talk to Gemini and do not need the warm-up thread
+os.environ['LLM_BACKEND'] = 'fake'
+os.environ['LLM_WARMUP'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+@pytest.fixture
+def client(tmp_path):
+    """A test client with an uploaded database holding one 'items' table"""
+    app = app_module.app
+    app.config.update(UPLOAD_FOLDER=str(tmp_path), TRANSLATION_CACHE_PATH=str(tmp_path / 'translation_cache.db'),
+                      PROFILER_ENABLED=False)
+
+    source = tmp_path / 'source.db'
+    conn = sqlite3.connect(source)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, price REAL)")
+    conn.executemany("INSERT INTO items (name, price) VALUES (?, ?)", [(f"item {i}", i * 1.5) for i in range(20)])
+    conn.commit()
+    conn.close()
+
+    client = app.test_client()
+    response = client.post('/upload', data={'file': (BytesIO(source.read_bytes()), 'source.db')})
+    assert response.status_code == 200, response.get_json()
+    return client
@@ -0,0 +1,40 @@
+import pytest
+
+REJECTED = [
+    "VACUUM",
+    "VACUUM INTO '{tmp_path}/copy.db'",
+    "REINDEX",
+    "ANALYZE",
+    "ATTACH DATABASE '{tmp_path}/other.db' AS other",
+    "PRAGMA user_version = 1",
+    "PRAGMA table_info(items)",
+    "DELETE FROM items",
+    "DROP TABLE items",
+    "SELECT * FROM items; SELECT * FROM items",
+    "SELECT 1; DROP TABLE items",
+]
+
+ACCEPTED = [
+    "SELECT * FROM items",
+    "WITH cheap AS (SELECT * FROM items WHERE price < 10) SELECT name FROM cheap",
+    "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5) SELECT x FROM n",
+]
+
+@pytest.mark.parametrize('route', ['/execute', '/export', '/explain'])
+@pytest.mark.parametrize('statement', REJECTED)
+def test_rejects_statements_that_are_not_a_single_select(client, tmp_path, route, statement):
+    response = client.post(route, json={'query': statement.format(tmp_path=tmp_path)})
+    assert response.status_code == 400
+    assert not (tmp_path / 'copy.db').exists()
+    assert not (tmp_path / 'other.db').exists()
+
+@pytest.mark.parametrize('statement', ACCEPTED)
+def test_accepts_read_only_selects(client, statement):
+    response = client.post('/execute', json={'query': statement})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['results']
+
+def test_table_is_untouched_after_rejected_writes(client):
+    client.post('/execute', json={'query': "DELETE FROM items"})
+    response = client.post('/execute', json={'query': "SELECT COUNT(*) FROM items"})
+    assert list(response.get_json()['results'][0].values()) == [20]